@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Benchmark parsing pagine AnimeSaturn: albero completo html.parser vs fast path lxml + SoupStrainer.
+
+Uso:
+  python scripts/bench_animesaturn_parse.py pagina_anime.html watch.html ...
+  python scripts/bench_animesaturn_parse.py salvate/          # tutti gli .html della cartella
+
+Senza argomenti usa una pagina sintetica (~300 episodi) per un confronto indicativo.
+Per ogni pagina e profilo (filtro usato dalle funzioni dello scraper) stampa tempo medio
+e picco di memoria (tracemalloc) dei due percorsi.
+"""
+import os, sys, time, tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src' / 'providers'))
+os.environ.setdefault('SCRAPER_CACHE_DISABLE', '1')
+
+from bs4 import BeautifulSoup  # noqa: E402
+import animesaturn  # noqa: E402
+
+PROFILES = {
+    # nome -> (argomenti parse_html, estrazione eseguita sul soup)
+    'get_episodes_list': ((('a',), {'class_': animesaturn.EP_CLASS_RE}), lambda s: len(s.select('a.bottone-ep'))),
+    'get_watch_url': ((('a', 'iframe', 'button'), {}), lambda s: len([a for a in s.find_all('a', href=True) if '/watch' in a['href']])),
+    'extract_mp4_url': ((('video', 'a'), {}), lambda s: (s.find('video', class_='jw-video') is not None, len(s.find_all('a', href=True)))),
+    'mal_check': ((('a',), {'href': animesaturn.MAL_HREF_RE}), lambda s: s.find('a', href=animesaturn.MAL_HREF_RE) is not None),
+}
+ROUNDS = int(os.getenv('BENCH_ROUNDS', '5'))
+
+
+def synthetic_page(episodes: int = 300) -> str:
+    eps = ''.join(f'<div class="episodes-button"><a class="btn bottone-ep" href="/ep/Anime-ep-{i}">Episodio {i}</a></div>'
+                  for i in range(1, episodes + 1))
+    filler = ''.join(f'<div class="card"><img src="/img/{i}.jpg"><span>Titolo {i}</span><p>{"lorem ipsum " * 20}</p></div>'
+                     for i in range(200))
+    return (f'<html><head><script>var x = {{"a": 1}};</script></head><body>{filler}'
+            f'<a href="https://myanimelist.net/anime/21">MAL</a>{eps}'
+            f'<a href="/watch?file=Anime-ep-1"><div>Guarda lo streaming</div></a>'
+            f'<video class="jw-video" src="https://cdn.example/x.m3u8"></video></body></html>')
+
+
+def measure(fn):
+    best = float('inf')
+    for _ in range(ROUNDS):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best * 1000, peak / 1024
+
+
+def iter_pages(args):
+    if not args:
+        yield 'synthetic', synthetic_page()
+        return
+    for arg in args:
+        p = Path(arg)
+        files = sorted(p.glob('*.html')) if p.is_dir() else [p]
+        for f in files:
+            yield f.name, f.read_text('utf-8', 'replace')
+
+
+def main():
+    print(f"lxml disponibile: {animesaturn._HAVE_LXML} | round: {ROUNDS}")
+    print(f"{'pagina':<28}{'profilo':<20}{'full ms':>10}{'fast ms':>10}{'full KiB':>11}{'fast KiB':>11}  stesso esito")
+    for name, html in iter_pages(sys.argv[1:]):
+        for prof, ((names, attrs), extract) in PROFILES.items():
+            full_res, fast_res = [], []
+            full_ms, full_kb = measure(lambda: full_res.append(extract(BeautifulSoup(html, 'html.parser'))))
+            fast_ms, fast_kb = measure(lambda: fast_res.append(extract(animesaturn.parse_html(html, *names, **attrs))))
+            same = full_res[-1] == fast_res[-1]
+            print(f"{name[:27]:<28}{prof:<20}{full_ms:>10.2f}{fast_ms:>10.2f}{full_kb:>11.0f}{fast_kb:>11.0f}  {same}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""Benchmark get_episodes_list di AnimeUnity contro un'API info_api locale simulata.
+
+Avvia un server HTTP locale che risponde a /info_api/<id>/ e /info_api/<id>/1?start_range&end_range
+con latenza artificiale, poi confronta il download sequenziale (1 worker) con quello a finestre parallele.
+
+Uso:
+  python scripts/bench_animeunity_episodes.py [--episodes 1100] [--latency 0.15] [--workers 1 2 4 8]
+"""
+import argparse, json, os, sys, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src' / 'providers'))
+os.environ.setdefault('SCRAPER_CACHE_DISABLE', '1')
+
+import animeunity_scraper  # noqa: E402
+
+
+def make_handler(total: int, latency: float):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive, come il server reale
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            time.sleep(latency)
+            parsed = urlparse(self.path)
+            if parsed.path.endswith('/1'):
+                qs = parse_qs(parsed.query)
+                start, end = int(qs['start_range'][0]), int(qs['end_range'][0])
+                body = {'episodes': [{'id': n, 'number': str(n)} for n in range(start, end + 1)]}
+            else:
+                body = {'episodes_count': total}
+            data = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+    return Handler
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--episodes', type=int, default=1100)
+    ap.add_argument('--latency', type=float, default=0.15, help='latenza simulata per richiesta (s)')
+    ap.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = ap.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(args.episodes, args.latency))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    animeunity_scraper.BASE_URL = f"http://127.0.0.1:{server.server_address[1]}"
+
+    ranges = -(-args.episodes // animeunity_scraper.EPISODES_RANGE)
+    print(f"episodi: {args.episodes} | finestre: {ranges} | latenza: {args.latency}s")
+    for workers in args.workers:
+        animeunity_scraper.EPISODES_WORKERS = workers
+        animeunity_scraper.CONN_STATS.update(requests=0, new_connections=0)
+        t0 = time.perf_counter()
+        eps = animeunity_scraper.get_episodes_list(1)
+        elapsed = time.perf_counter() - t0
+        ordered = [e['id'] for e in eps] == list(range(1, args.episodes + 1))
+        print(f"workers={workers:<3} {elapsed * 1000:8.0f} ms  episodi={len(eps)}  ordine ok={ordered}  "
+              f"richieste={animeunity_scraper.CONN_STATS['requests']} connessioni={animeunity_scraper.CONN_STATS['new_connections']}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
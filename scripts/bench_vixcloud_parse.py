@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Benchmark estrazione MP4 dalle pagine embed VixCloud: implementazione precedente
+(BeautifulSoup + regex ricompilate) vs scanner regex a passata singola.
+
+Uso:
+  python scripts/bench_vixcloud_parse.py embed1.html embed2.html ...
+  python scripts/bench_vixcloud_parse.py salvate/          # tutti gli .html della cartella
+
+Senza argomenti usa alcune pagine sintetiche (una per ciascun percorso di estrazione).
+Per ogni pagina stampa il tempo migliore dei due percorsi e se il link estratto coincide.
+"""
+import json, os, re, sys, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src' / 'providers'))
+os.environ.setdefault('SCRAPER_CACHE_DISABLE', '1')
+
+from bs4 import BeautifulSoup  # noqa: E402
+import animeunity_scraper  # noqa: E402
+
+ROUNDS = int(os.getenv('BENCH_ROUNDS', '20'))
+TOKEN = 'token=AbCdEf123&expires=1900000000'
+
+
+def legacy_parse(full_text):
+    """Logica di estrazione precedente (solo parsing, senza richiesta HTTP)."""
+    soup = BeautifulSoup(full_text, "html.parser")
+    for script in soup.find_all("script"):
+        if script.string:
+            mp4_match = re.search(r"(?:src_mp4|file)\s*[:=]\s*[\"']([^\"']+\.mp4[^\"']*)[\"']", script.string)
+            if mp4_match:
+                mp4_url = mp4_match.group(1).replace("\\/", "/")
+                if mp4_url.startswith("http"):
+                    return mp4_url
+    mp4_patterns = [
+        r"(?:file|source|src)\s*[:=]\s*[\"']([^\"']*au-d1-[^\"']*\.mp4[^\"']*)[\"']",
+        r"[\"']([^\"']*scws-content\.net[^\"']*\.mp4[^\"']*)[\"']",
+        r"(?:mp4|video)(?:Url|Source|File)\s*[:=]\s*[\"']([^\"']+\.mp4[^\"']*)[\"']"
+    ]
+    for pattern in mp4_patterns:
+        for match in re.findall(pattern, full_text, re.IGNORECASE):
+            clean_url = match.replace("\\/", "/")
+            if "token=" in clean_url and "expires=" in clean_url:
+                return clean_url
+    json_match = re.search(r'(?:config|window\.config)\s*=\s*(\{.*?\});', full_text, re.DOTALL)
+    if json_match:
+        return animeunity_scraper._vixcloud_config_mp4(full_text, json_match.start(1))
+    return None
+
+
+def synthetic_pages():
+    filler = ''.join(f'<div class="row"><span>{i}</span><p>{"lorem ipsum " * 15}</p></div>' for i in range(300))
+    vendor = '<script>' + ''.join(f'var v{i} = "{"x" * 40}"; function f{i}(a) {{ return a + {i}; }}\n' for i in range(400)) + '</script>'
+    config = {
+        "masterPlaylist": {"url": "https://vixcloud.co/playlist/123456?b=1", "params": {"token": "AbCdEf123", "expires": "1900000000"}},
+        "canPlayFHD": True,
+    }
+    pages = {
+        'src_mp4': f'<script>var src_mp4 = "https:\\/\\/au-d1-01.scws-content.net\\/download\\/1\\/ep.mp4?{TOKEN}";</script>',
+        'scws': f'<script>player.setup({{"sources": ["https://sc-u1-02.scws-content.net/download/1/ep.mp4?{TOKEN}"]}});</script>',
+        'config': f'<script>window.config = {json.dumps(config)};</script>',
+        'nessuno': '<script>window.video = {"id": 1};</script>',
+    }
+    for name, payload in pages.items():
+        yield name, f'<html><head>{vendor}</head><body>{filler}{payload}</body></html>'
+
+
+def iter_pages(args):
+    if not args:
+        yield from synthetic_pages()
+        return
+    for arg in args:
+        p = Path(arg)
+        files = sorted(p.glob('*.html')) if p.is_dir() else [p]
+        for f in files:
+            yield f.name, f.read_text('utf-8', 'replace')
+
+
+def best_ms(fn, html):
+    best = float('inf')
+    for _ in range(ROUNDS):
+        t0 = time.perf_counter()
+        result = fn(html)
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000, result
+
+
+def main():
+    print(f"round: {ROUNDS}")
+    print(f"{'pagina':<28}{'KiB':>7}{'legacy ms':>11}{'scan ms':>10}{'speedup':>9}  stesso link")
+    for name, html in iter_pages(sys.argv[1:]):
+        legacy_ms, legacy_url = best_ms(legacy_parse, html)
+        scan_ms, scan_url = best_ms(animeunity_scraper.parse_vixcloud_embed, html)
+        print(f"{name[:27]:<28}{len(html) / 1024:>7.0f}{legacy_ms:>11.2f}{scan_ms:>10.2f}"
+              f"{legacy_ms / max(scan_ms, 1e-6):>8.1f}x  {legacy_url == scan_url}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,5 @@
 import { spawn } from 'child_process';
-import { AnimeSaturnConfig, AnimeSaturnResult, AnimeSaturnEpisode, StreamForStremio } from '../types/animeunity';
+import { AnimeSaturnConfig, AnimeSaturnResult, StreamForStremio } from '../types/animeunity';
 import * as path from 'path';
 import axios from 'axios';
 import { KitsuProvider } from './kitsu';
@@ -405,31 +405,11 @@ export class AnimeSaturnProvider {
     }
     const streams: StreamForStremio[] = [];
     for (const { version, language_type } of animeVersions) {
-      const episodes: AnimeSaturnEpisode[] = await invokePythonScraper(['get_episodes', '--anime-url', version.url]);
-      console.log(`[AnimeSaturn] Episodi trovati per ${version.title}:`, episodes.map(e => e.title));
-      let targetEpisode: AnimeSaturnEpisode | undefined;
-      if (isMovie) {
-        targetEpisode = episodes[0];
-        console.log(`[AnimeSaturn] Selezionato primo episodio (movie):`, targetEpisode?.title);
-      } else if (episodeNumber != null) {
-        targetEpisode = episodes.find(ep => {
-          const match = ep.title.match(/E(\d+)/i);
-          if (match) {
-            return parseInt(match[1]) === episodeNumber;
-          }
-          return ep.title.includes(String(episodeNumber));
-        });
-        console.log(`[AnimeSaturn] Episodio selezionato per E${episodeNumber}:`, targetEpisode?.title);
-      } else {
-        targetEpisode = episodes[0];
-        console.log(`[AnimeSaturn] Selezionato primo episodio (default):`, targetEpisode?.title);
-      }
-      if (!targetEpisode) {
-        console.warn(`[AnimeSaturn] Nessun episodio trovato per la richiesta: S${seasonNumber}E${episodeNumber}`);
-        continue;
+      // Un solo processo Python: lista episodi -> pagina watch -> link finale
+      const scrapperArgs = ['resolve', '--anime-url', version.url];
+      if (!isMovie && episodeNumber != null) {
+        scrapperArgs.push('--episode', String(episodeNumber));
       }
-      // Preparare gli argomenti per lo scraper Python
-      const scrapperArgs = ['get_stream', '--episode-url', targetEpisode.url];
       
       // Aggiungi parametri MFP per lo streaming m3u8 se disponibili
       if (this.config.mfpProxyUrl) {
@@ -440,6 +420,11 @@ export class AnimeSaturnProvider {
       }
       
       const streamResult = await invokePythonScraper(scrapperArgs);
+      if (!streamResult || !streamResult.episode) {
+        console.warn(`[AnimeSaturn] Nessun episodio trovato per la richiesta: S${seasonNumber}E${episodeNumber} (${version.title})`);
+        continue;
+      }
+      console.log(`[AnimeSaturn] Episodio risolto per ${version.title}:`, streamResult.episode);
       let streamUrl = streamResult.url;
       let streamHeaders = streamResult.headers || undefined;
       const cleanName = version.title
@@ -7,7 +7,7 @@ Dipendenze: requests, beautifulsoup4 (pip install requests beautifulsoup4)
 """
 
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import re
 import sys
 import json
@@ -15,8 +15,20 @@ import urllib.parse
 import argparse
 import os
 import time
+import threading
+import queue
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Optional
 
+import scraper_cache
+
+try:
+    import lxml  # type: ignore  # noqa: F401
+    _HAVE_LXML = True
+except Exception:
+    _HAVE_LXML = False
+
 # Carica domini configurati
 with open(os.path.join(os.path.dirname(__file__), '../../config/domains.json'), encoding='utf-8') as f:
     DOMAINS = json.load(f)
@@ -27,11 +39,69 @@ HEADERS = {"User-Agent": USER_AGENT}
 SESSION = requests.Session()  # sessione globale condivisa
 DEBUG_MODE = os.getenv("ANIMESATURN_DEBUG", "0") == "1"
 TIMEOUT = 30
+BASE_HOST = urllib.parse.urlparse(BASE_URL).hostname or DOMAINS['animesaturn']
+# Cookie ASFast ottenuti da invocazioni precedenti: evitano il giro di challenge sulla prima richiesta
+scraper_cache.load_cookies(BASE_HOST, SESSION)
+# Verifica MAL ID: pagine anime scaricate in parallelo. Le verifiche restanti vengono annullate
+# appena i primi MAL_MAX_MATCHES match in ordine (SUB / ITA / CR) sono certi; si restituiscono
+# comunque tutti i match già confermati. 0 = verifica tutti i risultati
+MAL_CHECK_WORKERS = int(os.getenv("ANIMESATURN_MAL_WORKERS", "6"))
+MAL_MAX_MATCHES = int(os.getenv("ANIMESATURN_MAL_MAX_MATCHES", "3"))
+# Mappatura persistente MAL ID -> pagine AnimeSaturn verificate (TTL lungo per cogliere nuovi doppiaggi; 0 = permanente)
+MAL_MAP_STORE = 'animesaturn_mal_map'
+# Cache lista episodi per URL anime: serie concluse quasi statiche, in corso aggiornate spesso
+EPISODES_STORE = 'animesaturn_episodes'
+EPISODES_TTL_FINISHED = int(os.getenv("ANIMESATURN_EPISODES_TTL_FINISHED", str(7 * 24 * 3600)))
+EPISODES_TTL_AIRING = int(os.getenv("ANIMESATURN_EPISODES_TTL_AIRING", str(30 * 60)))
+# Cache link finale per URL episodio: scadenza dai parametri token/expires, altrimenti TTL di default
+STREAMS_STORE = 'animesaturn_streams'
+STREAM_TTL = int(os.getenv("ANIMESATURN_STREAM_TTL", str(6 * 3600)))
+STREAM_EXPIRY_MARGIN = 60
+STREAM_EXPIRY_PARAMS = ("expires", "expire", "expiry", "exp", "e", "valid_until", "validto")
+# Pagina "Player alternativo" scaricata in parallelo all'analisi della pagina watch
+ALT_PLAYER_SPECULATIVE = os.getenv("ANIMESATURN_ALT_SPECULATIVE", "1") == "1"
+# Download a range paralleli (download_mp4)
+DOWNLOAD_WORKERS = int(os.getenv("ANIMESATURN_DOWNLOAD_WORKERS", "4"))
+DOWNLOAD_CHUNK = int(os.getenv("ANIMESATURN_DOWNLOAD_CHUNK_MB", "8")) * 1024 * 1024
+DOWNLOAD_BUFFER = 1024 * 1024
+DOWNLOAD_RETRIES = 3
+# Cache ricerche (stale-while-revalidate): fresche per SEARCH_TTL, poi servite stale per max 24h
+SEARCH_STORE = 'animesaturn_search'
+SEARCH_TTL = int(os.getenv("ANIMESATURN_SEARCH_TTL", str(6 * 3600)))
+SEARCH_REFRESH_GRACE = 120  # secondi prima di poter riavviare un refresh rimasto appeso
+# Pagine di ricerca richieste in parallelo per blocco (1 = paginazione sequenziale)
+SEARCH_PREFETCH_PAGES = int(os.getenv("ANIMESATURN_SEARCH_PREFETCH", "2"))
+MAL_MAP_TTL = int(os.getenv("ANIMESATURN_MAL_MAP_TTL", str(30 * 24 * 3600)))
 
 def debug(msg: str):
     if DEBUG_MODE:
         print(f"[DEBUG] {msg}", file=sys.stderr)
 
+# Regex precompilate usate sulle pagine watch / anime
+MP4_RE = re.compile(r'https://[\w\.-]+/[^"\']+\.mp4')
+JW_M3U8_RE = re.compile(r'jwplayer\([\'"]player_hls[\'"]\)\.setup\(\{\s*file:\s*[\'"]([^"\']+\.m3u8)[\'"]')
+# <a href="...">...Player alternativo</a> direttamente sul sorgente, prima del parsing
+ALT_PLAYER_RE = re.compile(r'<a\s[^>]*href=["\']([^"\']+)["\'][^>]*>(?:(?!</a>).){0,400}?Player alternativo', re.S)
+SRC_M3U8_RE = re.compile(r'src=[\'"]([^"\']+\.m3u8)[\'"]')
+MAL_HREF_RE = re.compile(r"myanimelist\.net/anime/(\d+)")
+# Filtro classe come regex: con SoupStrainer è molto più rapido di class_="bottone-ep"
+EP_CLASS_RE = re.compile(r"\bbottone-ep\b")
+# "Stato: In corso / Finito" nella scheda anime (tag intermedi ammessi)
+ANIME_STATUS_RE = re.compile(r'Stato:\s*(?:</?\w+[^>]*>\s*)*([^<\n]+)', re.I)
+FINISHED_STATUSES = ("finito", "concluso", "terminato", "completato")
+
+def parse_html(html: str, *names, **attrs) -> BeautifulSoup:
+    """Fast path: con lxml costruisce solo i tag richiesti (SoupStrainer).
+    Fallback: albero completo html.parser se lxml manca o il filtro non trova nulla."""
+    if _HAVE_LXML and (names or attrs):
+        try:
+            soup = BeautifulSoup(html, "lxml", parse_only=SoupStrainer(list(names) or None, **attrs))
+            if soup.find(True) is not None:
+                return soup
+        except Exception as e:
+            debug(f"parse_html fast path fallito: {e}")
+    return BeautifulSoup(html, "html.parser")
+
 def safe_ascii_header(value: str) -> str:
     """Rende sicuro un valore header rimpiazzando caratteri non ASCII."""
     return ''.join(c if 32 <= ord(c) < 127 else '?' for c in value)
@@ -42,17 +112,19 @@ def handle_challenge(resp: requests.Response, session: requests.Session, origina
     try:
         text = resp.text
         # Il sito fornisce document.cookie="ASFast-..." senza backslash; adattiamo regex flessibile
-        cookie_match = re.search(r'document.cookie="(ASFast-[^=]+=[^";]+)', text)
+        cookie_match = re.search(r'document.cookie="((ASFast-[^=]+=[^";]+)[^"]*)', text)
         if cookie_match:
-            cookie_kv = cookie_match.group(1)
+            cookie_kv = cookie_match.group(2)
             if '=' in cookie_kv:
                 name, value = cookie_kv.split('=', 1)
-                host = urllib.parse.urlparse(BASE_URL).hostname
+                host = BASE_HOST
                 if host:
                     session.cookies.set(name, value, domain=host)
                     # Imposta anche su www.<host>
                     if not host.startswith('www.'):
                         session.cookies.set(name, value, domain='www.' + host)
+                    # Persiste il cookie per le prossime invocazioni
+                    scraper_cache.save_cookie(host, name, value, scraper_cache.cookie_ttl(cookie_match.group(1)))
                 debug(f"handle_challenge: impostato cookie {name}")
         # Redirect opzionale
         redir = re.search(r'window\\.location\\.href\s*=\s*\"([^\"]+)\"', text)
@@ -69,109 +141,208 @@ def handle_challenge(resp: requests.Response, session: requests.Session, origina
         return False
 
 
+def _daemon_map(fn, items, workers, stop: threading.Event) -> "queue.Queue":
+    """Esegue fn(item) su al massimo `workers` thread daemon; restituisce la coda dei risultati
+    (indice, risultato, eccezione) in ordine di completamento. Impostato `stop`, i thread non
+    prendono altro lavoro; quelli ancora in volo non bloccano l'uscita del processo."""
+    tasks = queue.Queue()
+    for idx, item in enumerate(items):
+        tasks.put((idx, item))
+    results = queue.Queue()
+
+    def _worker():
+        while not stop.is_set():
+            try:
+                idx, item = tasks.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results.put((idx, fn(item), None))
+            except Exception as e:
+                results.put((idx, None, e))
+
+    for _ in range(max(1, min(workers, len(items)))):
+        threading.Thread(target=_worker, daemon=True).start()
+    return results
+
+def _fetch_search_page(query, page, session: requests.Session, state: dict, speculative: bool = False):
+    """Scarica una pagina della ricerca XHR gestendo challenge e retry; restituisce la lista JSON grezza.
+    Con speculative=True (prefetch) un solo tentativo, nessuna gestione challenge e None su
+    qualsiasi errore: la pagina verrà riscaricata normalmente se davvero serve."""
+    MAX_RETRIES = 0 if speculative else 2  # ritenta su errori transitori (rete / JSON decode / content-type errato)
+    search_url = f"{BASE_URL}/index.php?search=1&key={query.replace(' ', '+')}&page={page}"
+    referer_query = urllib.parse.quote_plus(query)
+    headers = {
+        "User-Agent": USER_AGENT,
+        "Referer": safe_ascii_header(f"{BASE_URL}/animelist?search={referer_query}"),
+        "X-Requested-With": "XMLHttpRequest",
+        "Accept": "application/json, text/javascript, */*; q=0.01",
+        "Accept-Language": "it-IT,it;q=0.9,en-US;q=0.8,en;q=0.7",
+        "Connection": "keep-alive"
+    }
+    debug(f"Search page={page} URL={search_url}")
+    attempt = 0
+    page_results = []
+    while True:
+        error_to_raise = None
+        try:
+            # timeout (connect, read) per evitare blocchi lunghi
+            resp = session.get(search_url, headers=headers, timeout=(5, 20))
+        except requests.exceptions.RequestException as e:
+            error_to_raise = f"Errore rete: {e}"
+        else:
+            status = resp.status_code
+            ctype = resp.headers.get('Content-Type', '')
+            # Rilevamento page anti-bot / HTML imprevisto
+            body_start = resp.text[:200]
+            is_probably_html = '<html' in body_start.lower() and 'json' not in ctype.lower()
+            # Bypass challenge: se status 202 o 200 HTML con script cookie
+            challenge_cookie = None
+            if (status == 202 or status == 200) and ('document.cookie="ASFast-' in resp.text):
+                if speculative:
+                    return None
+                if not state.get("challenge_saved"):
+                    try:
+                        with open('challenge_page.html', 'w', encoding='utf-8') as fch:
+                            fch.write(resp.text)
+                        debug("Salvata pagina challenge in challenge_page.html")
+                    except Exception as fe:
+                        debug(f"Impossibile salvare challenge_page.html: {fe}")
+                    state["challenge_saved"] = True
+                # Prova gestione challenge
+                handled = handle_challenge(resp, session, headers)
+                if handled:
+                    try:
+                        resp = session.get(search_url, headers=headers, timeout=(5, 20))
+                        status = resp.status_code
+                        ctype = resp.headers.get('Content-Type', '')
+                        body_start = resp.text[:200]
+                        is_probably_html = '<html' in body_start.lower() and 'json' not in ctype.lower()
+                    except Exception as e2:
+                        error_to_raise = f"Errore rete dopo handle_challenge: {e2}"
+                    else:
+                        debug(f"Retry post-challenge status={status}")
+                else:
+                    debug("Challenge pattern rilevato ma non gestito (regex mismatch)")
+
+            if not error_to_raise:
+                if status != 200:
+                    snippet = body_start.replace('\n', ' ')[:160]
+                    error_to_raise = f"HTTP {status} non-200 snippet='{snippet}...'"
+                else:
+                    body_trim = body_start.lstrip()
+                    looks_like_json = body_trim.startswith('{') or body_trim.startswith('[')
+                    content_is_json = 'json' in ctype.lower()
+                    if content_is_json or looks_like_json:
+                        try:
+                            page_results = resp.json()
+                        except Exception as e:
+                            snippet = body_start.replace('\n', ' ')[:160]
+                            error_to_raise = f"JSONDecodeError: {e} snippet='{snippet}...'"
+                        else:
+                            if not content_is_json:
+                                debug(f"Forzato parsing JSON (ctype={ctype})")
+                            break
+                    else:
+                        snippet = body_start.replace('\n', ' ')[:160]
+                        error_to_raise = f"Content-Type={ctype} non-json e body non riconosciuto come JSON snippet='{snippet}...'"
+
+        if error_to_raise:
+            debug(f"Tentativo {attempt+1}/{MAX_RETRIES+1} fallito page={page}: {error_to_raise}")
+            if attempt < MAX_RETRIES:
+                attempt += 1
+                time.sleep(1 + attempt * 0.5)
+                continue
+            # Esauriti tentativi
+            if speculative:
+                return None
+            # Modalità strict: se settata ANIMESATURN_STRICT=1 alza eccezioni invece di restituire lista vuota
+            if os.getenv("ANIMESATURN_STRICT", "0") == "1":
+                raise RuntimeError(f"search_anime fallita page={page}: {error_to_raise}")
+            # Modalità non-strict: interrompe la paginazione. Se page==1 results resterà vuoto
+            state["failed_pages"].add(page)
+            page_results = []
+            break
+    # Fine while retry
+    return page_results
+
 def search_anime(query, session: Optional[requests.Session] = None):
-    """Ricerca anime tramite la barra di ricerca di AnimeSaturn, con paginazione"""
+    """Ricerca anime con cache stale-while-revalidate: risultato fresco servito direttamente,
+    risultato scaduto servito subito mentre un processo separato lo aggiorna."""
+    key = _search_cache_key(query)
+    rec = scraper_cache.get_record(SEARCH_STORE, key)
+    if scraper_cache.is_fresh(rec):
+        debug(f"search_anime: cache hit '{query}'")
+        return rec["value"]
+    if rec and rec.get("exp") and time.time() - rec["exp"] < scraper_cache.PRUNE_GRACE:
+        debug(f"search_anime: cache stale '{query}', refresh in background")
+        _spawn_search_refresh(query, key)
+        return rec["value"]
+    return refresh_search_cache(query, session)
+
+def _search_cache_key(query) -> str:
+    return f"{BASE_HOST}|{' '.join(query.lower().split())}"
+
+def refresh_search_cache(query, session: Optional[requests.Session] = None):
+    """Ricerca remota; salva in cache solo ricerche complete e non vuote (mai challenge / HTML)."""
+    results, complete = _search_anime_remote(query, session)
+    if complete and results:
+        scraper_cache.put_cached(SEARCH_STORE, _search_cache_key(query), results, ttl=SEARCH_TTL)
+    return results
+
+def _spawn_search_refresh(query, key):
+    """Avvia un solo refresh in background per chiave (marcatore refresh_at nel record)."""
+    claimed = []
+
+    def _mutate(data):
+        rec = data.get(key)
+        if isinstance(rec, dict) and time.time() - rec.get("refresh_at", 0) > SEARCH_REFRESH_GRACE:
+            rec["refresh_at"] = time.time()
+            claimed.append(True)
+    scraper_cache.update_store(SEARCH_STORE, _mutate)
+    if not claimed:
+        return
+    try:
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), "search", "--query", query, "--refresh-cache"],
+                         stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                         start_new_session=True)
+    except Exception as e:
+        debug(f"search_anime: avvio refresh background fallito: {e}")
+
+def _search_anime_remote(query, session: Optional[requests.Session] = None):
+    """Ricerca tramite la barra di ricerca di AnimeSaturn, con paginazione.
+    Mentre si scarica una pagina, le SEARCH_PREFETCH_PAGES - 1 successive vengono richieste in
+    anticipo su thread daemon (un tentativo, senza challenge): se la pagina corrente è l'ultima
+    non si aspetta il prefetch, se una pagina anticipata fallisce viene riscaricata normalmente.
+    Restituisce (risultati, completa) dove completa=False se una pagina utile è fallita."""
     # Usa sessione persistente per mantenere cookie e headers
     if session is None:
         # Usa sessione globale per conservare cookie challenge fra invocazioni
         session = SESSION
     results = []
     page = 1
-    # Modalità strict: se settata ANIMESATURN_STRICT=1 alza eccezioni invece di restituire lista vuota
-    STRICT_MODE = os.getenv("ANIMESATURN_STRICT", "0") == "1"
-    MAX_RETRIES = 2  # ritenta su errori transitori (rete / JSON decode / content-type errato)
-    challenge_saved = False  # salviamo solo la prima pagina challenge
-    while True:
-        search_url = f"{BASE_URL}/index.php?search=1&key={query.replace(' ', '+')}&page={page}"
-        referer_query = urllib.parse.quote_plus(query)
-        headers = {
-            "User-Agent": USER_AGENT,
-            "Referer": safe_ascii_header(f"{BASE_URL}/animelist?search={referer_query}"),
-            "X-Requested-With": "XMLHttpRequest",
-            "Accept": "application/json, text/javascript, */*; q=0.01",
-            "Accept-Language": "it-IT,it;q=0.9,en-US;q=0.8,en;q=0.7",
-            "Connection": "keep-alive"
-        }
-        debug(f"Search page={page} URL={search_url}")
-        attempt = 0
-        page_results = []
-        while True:
-            error_to_raise = None
-            try:
-                # timeout (connect, read) per evitare blocchi lunghi
-                resp = session.get(search_url, headers=headers, timeout=(5, 20))
-            except requests.exceptions.RequestException as e:
-                error_to_raise = f"Errore rete: {e}"
-            else:
-                status = resp.status_code
-                ctype = resp.headers.get('Content-Type', '')
-                # Rilevamento page anti-bot / HTML imprevisto
-                body_start = resp.text[:200]
-                is_probably_html = '<html' in body_start.lower() and 'json' not in ctype.lower()
-                # Bypass challenge: se status 202 o 200 HTML con script cookie
-                challenge_cookie = None
-                if (status == 202 or status == 200) and ('document.cookie="ASFast-' in resp.text):
-                    if not challenge_saved:
-                        try:
-                            with open('challenge_page.html', 'w', encoding='utf-8') as fch:
-                                fch.write(resp.text)
-                            debug("Salvata pagina challenge in challenge_page.html")
-                        except Exception as fe:
-                            debug(f"Impossibile salvare challenge_page.html: {fe}")
-                        challenge_saved = True
-                    # Prova gestione challenge
-                    handled = handle_challenge(resp, session, headers)
-                    if handled:
-                        try:
-                            resp = session.get(search_url, headers=headers, timeout=(5, 20))
-                            status = resp.status_code
-                            ctype = resp.headers.get('Content-Type', '')
-                            body_start = resp.text[:200]
-                            is_probably_html = '<html' in body_start.lower() and 'json' not in ctype.lower()
-                        except Exception as e2:
-                            error_to_raise = f"Errore rete dopo handle_challenge: {e2}"
-                        else:
-                            debug(f"Retry post-challenge status={status}")
-                    else:
-                        debug("Challenge pattern rilevato ma non gestito (regex mismatch)")
+    state = {"challenge_saved": False, "failed_pages": set()}  # salviamo solo la prima pagina challenge
+    prefetched = {}  # pagina -> coda con il risultato del prefetch
 
-                if not error_to_raise:
-                    if status != 200:
-                        snippet = body_start.replace('\n', ' ')[:160]
-                        error_to_raise = f"HTTP {status} non-200 snippet='{snippet}...'"
-                    else:
-                        body_trim = body_start.lstrip()
-                        looks_like_json = body_trim.startswith('{') or body_trim.startswith('[')
-                        content_is_json = 'json' in ctype.lower()
-                        if content_is_json or looks_like_json:
-                            try:
-                                page_results = resp.json()
-                            except Exception as e:
-                                snippet = body_start.replace('\n', ' ')[:160]
-                                error_to_raise = f"JSONDecodeError: {e} snippet='{snippet}...'"
-                            else:
-                                if not content_is_json:
-                                    debug(f"Forzato parsing JSON (ctype={ctype})")
-                                break
-                        else:
-                            snippet = body_start.replace('\n', ' ')[:160]
-                            error_to_raise = f"Content-Type={ctype} non-json e body non riconosciuto come JSON snippet='{snippet}...'"
+    def _prefetch(p):
+        out = prefetched[p] = queue.Queue(maxsize=1)
 
-            if error_to_raise:
-                debug(f"Tentativo {attempt+1}/{MAX_RETRIES+1} fallito page={page}: {error_to_raise}")
-                if attempt < MAX_RETRIES:
-                    attempt += 1
-                    time.sleep(1 + attempt * 0.5)
-                    continue
-                # Esauriti tentativi
-                if STRICT_MODE:
-                    raise RuntimeError(f"search_anime fallita page={page}: {error_to_raise}")
-                # Modalità non-strict: interrompe la paginazione. Se page==1 results resterà vuoto
-                page_results = []
-                break
-        # Fine while retry
+        def _run():
+            try:
+                out.put(_fetch_search_page(query, p, session, state, speculative=True))
+            except Exception:
+                out.put(None)
+        threading.Thread(target=_run, daemon=True).start()
+
+    while True:
+        for p in range(page + 1, page + max(1, SEARCH_PREFETCH_PAGES)):
+            if p not in prefetched:
+                _prefetch(p)
+        page_results = prefetched.pop(page).get() if page in prefetched else None
+        if page_results is None:
+            page_results = _fetch_search_page(query, page, session, state)
         if not page_results:
-            break
+            return results, page not in state["failed_pages"]
         for item in page_results:
             results.append({
                 "title": item["name"],
@@ -179,9 +350,8 @@ def search_anime(query, session: Optional[requests.Session] = None):
             })
         # Se meno di 20 risultati (o la quantità che AnimeSaturn mostra per pagina), siamo all'ultima pagina
         if len(page_results) < 20:
-            break
+            return results, True
         page += 1
-    return results
 
 def get_watch_url(episode_url, session: Optional[requests.Session] = None):
     if session is None:
@@ -197,7 +367,7 @@ def get_watch_url(episode_url, session: Optional[requests.Session] = None):
                 debug(f"get_watch_url retry errore: {e}")
     resp.raise_for_status()
     html_content = resp.text
-    soup = BeautifulSoup(html_content, "html.parser")
+    soup = parse_html(html_content, "a", "iframe", "button")
     
     # Stampa tutti i link per debug
     print("[DEBUG] Lista di tutti i link nella pagina:", file=sys.stderr)
@@ -250,29 +420,10 @@ def get_watch_url(episode_url, session: Optional[requests.Session] = None):
     print(f"[DEBUG] Salvata pagina di debug in debug_page.html", file=sys.stderr)
     return None
 
-def extract_mp4_url(watch_url, session: Optional[requests.Session] = None):
-    if session is None:
-        session = SESSION
-    print(f"[DEBUG] Analisi URL: {watch_url}", file=sys.stderr)
-    resp = session.get(watch_url, headers=HEADERS, timeout=TIMEOUT)
-    if (resp.status_code in (200,202)) and 'document.cookie="ASFast-' in resp.text:
-        handled = handle_challenge(resp, session, HEADERS)
-        if handled:
-            try:
-                resp = session.get(watch_url, headers=HEADERS, timeout=TIMEOUT)
-            except Exception as e:
-                debug(f"extract_mp4_url retry errore: {e}")
-    resp.raise_for_status()
-    html_content = resp.text
-    soup = BeautifulSoup(html_content, "html.parser")
-    
-    print(f"[DEBUG] Dimensione HTML: {len(html_content)} caratteri", file=sys.stderr)
-    
-    # Metodo 1: Cerca direttamente il link mp4 nel sorgente (metodo originale)
-    mp4_match = re.search(r'https://[\w\.-]+/[^"\']+\.mp4', html_content)
-    if mp4_match:
-        print(f"[DEBUG] Trovato MP4 con metodo 1: {mp4_match.group(0)}", file=sys.stderr)
-        return mp4_match.group(0)
+def _stream_from_watch_page(html_content):
+    """Metodi 2-4 sulla pagina watch. Restituisce (link, link player alternativo trovato nel DOM)."""
+    # Metodi 2-3 e player alternativo lavorano solo su <video> e <a>
+    soup = parse_html(html_content, "video", "a")
     
     # Metodo 2: Analizza i tag video/source (metodo originale)
     video = soup.find("video", class_="vjs-tech")
@@ -281,7 +432,7 @@ def extract_mp4_url(watch_url, session: Optional[requests.Session] = None):
         source = video.find("source")
         if source and source.get("src"):
             print(f"[DEBUG] Trovato source in vjs-tech: {source['src']}", file=sys.stderr)
-            return source["src"]
+            return source["src"], None
     else:
         print("[DEBUG] Nessun video con classe vjs-tech trovato", file=sys.stderr)
     
@@ -291,15 +442,15 @@ def extract_mp4_url(watch_url, session: Optional[requests.Session] = None):
         print(f"[DEBUG] Trovato video con classe jw-video", file=sys.stderr)
         if jw_video.get("src"):
             print(f"[DEBUG] Trovato src in jw-video: {jw_video['src']}", file=sys.stderr)
-            return jw_video["src"]
+            return jw_video["src"], None
     else:
         print("[DEBUG] Nessun video con classe jw-video trovato", file=sys.stderr)
     
     # Metodo 4: Cerca link m3u8 nel jwplayer setup
-    m3u8_match = re.search(r'jwplayer\([\'"]player_hls[\'"]\)\.setup\(\{\s*file:\s*[\'"]([^"\']+\.m3u8)[\'"]', html_content)
+    m3u8_match = JW_M3U8_RE.search(html_content)
     if m3u8_match:
         print(f"[DEBUG] Trovato m3u8 con metodo jwplayer: {m3u8_match.group(1)}", file=sys.stderr)
-        return m3u8_match.group(1)
+        return m3u8_match.group(1), None
     
     # Cercare in altri posti della pagina per link alternativi
     player_alternativo = None
@@ -311,59 +462,185 @@ def extract_mp4_url(watch_url, session: Optional[requests.Session] = None):
             print(f"[DEBUG] Trovato link a player alternativo: {player_alternativo}", file=sys.stderr)
             break
     
-    # Se trovato un link al player alternativo, visita quella pagina
-    if player_alternativo:
+    return None, player_alternativo
+
+def _stream_from_alt_player(player_alternativo, session: requests.Session):
+    """Scarica e analizza la pagina "Player alternativo"; None se non trova link."""
+    try:
+        alt_resp = session.get(player_alternativo, headers=HEADERS, timeout=TIMEOUT)
+        alt_resp.raise_for_status()
+        alt_html = alt_resp.text
+        alt_soup = parse_html(alt_html, "video", "iframe", "div")
+        
+        print(f"[DEBUG] Dimensione HTML player alternativo: {len(alt_html)} caratteri", file=sys.stderr)
+        
+        # Cerca mp4 nei metodi alternativi
+        alt_mp4_match = MP4_RE.search(alt_html)
+        if alt_mp4_match:
+            print(f"[DEBUG] Trovato MP4 nel player alternativo: {alt_mp4_match.group(0)}", file=sys.stderr)
+            return alt_mp4_match.group(0)
+        
+        # Cerca source in video
+        alt_video = alt_soup.find("video")
+        if alt_video:
+            print(f"[DEBUG] Trovato video nel player alternativo", file=sys.stderr)
+            alt_source = alt_video.find("source")
+            if alt_source and alt_source.get("src"):
+                print(f"[DEBUG] Trovato source nel player alternativo: {alt_source['src']}", file=sys.stderr)
+                return alt_source["src"]
+        
+        # Cerca m3u8 nel player alternativo
+        m3u8_match = SRC_M3U8_RE.search(alt_html)
+        if m3u8_match:
+            print(f"[DEBUG] Trovato m3u8 nel player alternativo: {m3u8_match.group(1)}", file=sys.stderr)
+            return m3u8_match.group(1)
+        
+        # Stampa i primi server disponibili per debug
+        server_dropdown = alt_soup.find("div", class_="dropdown-menu")
+        if server_dropdown:
+            print("[DEBUG] Server disponibili nel player alternativo:", file=sys.stderr)
+            for a in server_dropdown.find_all("a", href=True):
+                print(f"[DEBUG] - {a.text.strip()}: {a['href']}", file=sys.stderr)
+        
+        # Prova a trovare iframe con video
+        iframe = alt_soup.find("iframe")
+        if iframe and iframe.get("src"):
+            print(f"[DEBUG] Trovato iframe nel player alternativo: {iframe['src']}", file=sys.stderr)
+        
+    except Exception as e:
+        print(f"[DEBUG] Errore cercando nel player alternativo: {e}", file=sys.stderr)
+    return None
+
+def extract_mp4_url(watch_url, session: Optional[requests.Session] = None):
+    if session is None:
+        session = SESSION
+    print(f"[DEBUG] Analisi URL: {watch_url}", file=sys.stderr)
+    resp = session.get(watch_url, headers=HEADERS, timeout=TIMEOUT)
+    if (resp.status_code in (200,202)) and 'document.cookie="ASFast-' in resp.text:
+        handled = handle_challenge(resp, session, HEADERS)
+        if handled:
+            try:
+                resp = session.get(watch_url, headers=HEADERS, timeout=TIMEOUT)
+            except Exception as e:
+                debug(f"extract_mp4_url retry errore: {e}")
+    resp.raise_for_status()
+    html_content = resp.text
+    
+    print(f"[DEBUG] Dimensione HTML: {len(html_content)} caratteri", file=sys.stderr)
+    
+    # Metodo 1: Cerca direttamente il link mp4 nel sorgente (metodo originale)
+    mp4_match = MP4_RE.search(html_content)
+    if mp4_match:
+        print(f"[DEBUG] Trovato MP4 con metodo 1: {mp4_match.group(0)}", file=sys.stderr)
+        return mp4_match.group(0)
+
+    # Player alternativo individuato subito sul sorgente grezzo e scaricato in parallelo
+    # all'analisi della pagina principale: vince il primo dei due che restituisce un link
+    alt_match = ALT_PLAYER_RE.search(html_content) if ALT_PLAYER_SPECULATIVE else None
+    speculative_alt = None
+    if alt_match:
+        speculative_alt = alt_match.group(1)
+        if not speculative_alt.startswith('http'):
+            speculative_alt = BASE_URL + speculative_alt
+        print(f"[DEBUG] Player alternativo richiesto in parallelo: {speculative_alt}", file=sys.stderr)
+    alt_results = queue.Queue()
+    if speculative_alt:
+        # Thread daemon: se la pagina principale basta, l'uscita del processo non aspetta il player alternativo
+        threading.Thread(target=lambda: alt_results.put(_stream_from_alt_player(speculative_alt, session)),
+                         daemon=True).start()
+    stream_url, player_alternativo = _stream_from_watch_page(html_content)
+    if speculative_alt:
         try:
-            alt_resp = session.get(player_alternativo, headers=HEADERS, timeout=TIMEOUT)
-            alt_resp.raise_for_status()
-            alt_soup = BeautifulSoup(alt_resp.text, "html.parser")
-            alt_html = alt_resp.text
-            
-            print(f"[DEBUG] Dimensione HTML player alternativo: {len(alt_html)} caratteri", file=sys.stderr)
-            
-            # Cerca mp4 nei metodi alternativi
-            alt_mp4_match = re.search(r'https://[\w\.-]+/[^"\']+\.mp4', alt_html)
-            if alt_mp4_match:
-                print(f"[DEBUG] Trovato MP4 nel player alternativo: {alt_mp4_match.group(0)}", file=sys.stderr)
-                return alt_mp4_match.group(0)
-            
-            # Cerca source in video
-            alt_video = alt_soup.find("video")
-            if alt_video:
-                print(f"[DEBUG] Trovato video nel player alternativo", file=sys.stderr)
-                alt_source = alt_video.find("source")
-                if alt_source and alt_source.get("src"):
-                    print(f"[DEBUG] Trovato source nel player alternativo: {alt_source['src']}", file=sys.stderr)
-                    return alt_source["src"]
-            
-            # Cerca m3u8 nel player alternativo
-            m3u8_match = re.search(r'src=[\'"]([^"\']+\.m3u8)[\'"]', alt_html)
-            if m3u8_match:
-                print(f"[DEBUG] Trovato m3u8 nel player alternativo: {m3u8_match.group(1)}", file=sys.stderr)
-                return m3u8_match.group(1)
-            
-            # Stampa i primi server disponibili per debug
-            server_dropdown = alt_soup.find("div", class_="dropdown-menu")
-            if server_dropdown:
-                print("[DEBUG] Server disponibili nel player alternativo:", file=sys.stderr)
-                for a in server_dropdown.find_all("a", href=True):
-                    print(f"[DEBUG] - {a.text.strip()}: {a['href']}", file=sys.stderr)
-            
-            # Prova a trovare iframe con video
-            iframe = alt_soup.find("iframe")
-            if iframe and iframe.get("src"):
-                print(f"[DEBUG] Trovato iframe nel player alternativo: {iframe['src']}", file=sys.stderr)
-            
-        except Exception as e:
-            print(f"[DEBUG] Errore cercando nel player alternativo: {e}", file=sys.stderr)
-    else:
+            alt_stream = alt_results.get_nowait() if stream_url else alt_results.get(timeout=TIMEOUT + 5)
+        except queue.Empty:
+            alt_stream = None
+        if alt_stream:
+            # Player alternativo arrivato per primo (o unico con un link)
+            return alt_stream
+    if stream_url:
+        return stream_url
+    
+    # Se trovato un link al player alternativo non già visitato, visita quella pagina
+    if player_alternativo and player_alternativo != speculative_alt:
+        stream_url = _stream_from_alt_player(player_alternativo, session)
+        if stream_url:
+            return stream_url
+    elif not player_alternativo and not speculative_alt:
         print("[DEBUG] Nessun player alternativo trovato", file=sys.stderr)
     
     # Debug finale
     print("[DEBUG] Nessun link trovato dopo tutti i tentativi", file=sys.stderr)
     return None
 
+def stream_url_ttl(stream_url) -> int:
+    """Secondi di validità residui di un link: usa expires/exp/... (epoch) se presente."""
+    query = urllib.parse.parse_qs(urllib.parse.urlparse(stream_url).query)
+    for key in STREAM_EXPIRY_PARAMS:
+        value = (query.get(key) or [""])[0]
+        if value.isdigit():
+            ts = int(value)
+            if ts > 10**12:  # millisecondi
+                ts //= 1000
+            if ts > 10**9:
+                return int(ts - time.time() - STREAM_EXPIRY_MARGIN)
+    return STREAM_TTL
+
+def is_stream_alive(stream_url, watch_url, session: requests.Session) -> bool:
+    """Controllo leggero su un link in cache: GET del primo byte con il Referer originale."""
+    headers = {"User-Agent": USER_AGENT, "Referer": watch_url, "Range": "bytes=0-0"}
+    try:
+        r = session.get(stream_url, headers=headers, timeout=(5, 10), stream=True)
+        r.close()
+    except requests.exceptions.RequestException as e:
+        debug(f"is_stream_alive errore: {e}")
+        return False
+    debug(f"is_stream_alive status={r.status_code} {stream_url}")
+    return r.status_code < 400
+
+def resolve_stream_url(episode_url, session: Optional[requests.Session] = None):
+    """Pagina watch + link finale per un episodio; riusa il link in cache finché è vivo."""
+    if session is None:
+        session = SESSION
+    cached = scraper_cache.get_cached(STREAMS_STORE, episode_url)
+    if isinstance(cached, dict) and cached.get("stream_url"):
+        if is_stream_alive(cached["stream_url"], cached.get("watch_url") or episode_url, session):
+            debug(f"resolve_stream_url: link in cache per {episode_url}")
+            return cached.get("watch_url"), cached["stream_url"]
+        debug("resolve_stream_url: link in cache non più valido, nuovo scraping")
+        scraper_cache.drop_cached(STREAMS_STORE, episode_url)
+    watch_url = get_watch_url(episode_url, session=session)
+    stream_url = extract_mp4_url(watch_url, session=session) if watch_url else None
+    if stream_url:
+        ttl = stream_url_ttl(stream_url)
+        if ttl > 0:
+            scraper_cache.put_cached(STREAMS_STORE, episode_url, {"watch_url": watch_url, "stream_url": stream_url}, ttl=ttl)
+    return watch_url, stream_url
+
 def get_episodes_list(anime_url, session: Optional[requests.Session] = None):
+    """Lista episodi con cache per URL anime: TTL lungo per serie concluse, breve per quelle in corso.
+    Con record scaduto un solo processo aggiorna, gli altri ricevono subito la lista stale."""
+    rec = scraper_cache.get_record(EPISODES_STORE, anime_url)
+    if scraper_cache.is_fresh(rec):
+        debug(f"get_episodes_list: cache hit {anime_url}")
+        return rec["value"]["episodes"]
+    if rec is None:
+        return _fetch_episodes_list(anime_url, session)
+    with scraper_cache.refresh_lock(EPISODES_STORE, anime_url) as owner:
+        if not owner:
+            debug(f"get_episodes_list: refresh in corso altrove, servo lista stale {anime_url}")
+            return rec["value"]["episodes"]
+        try:
+            return _fetch_episodes_list(anime_url, session)
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                raise
+            debug(f"get_episodes_list: refresh fallito ({e}), servo lista stale")
+            return rec["value"]["episodes"]
+        except requests.exceptions.RequestException as e:
+            debug(f"get_episodes_list: refresh fallito ({e}), servo lista stale")
+            return rec["value"]["episodes"]
+
+def _fetch_episodes_list(anime_url, session: Optional[requests.Session] = None):
     if session is None:
         session = SESSION
     resp = session.get(anime_url, headers=HEADERS, timeout=TIMEOUT)
@@ -375,8 +652,12 @@ def get_episodes_list(anime_url, session: Optional[requests.Session] = None):
                 resp = session.get(anime_url, headers=HEADERS, timeout=TIMEOUT)
             except Exception as e:
                 debug(f"get_episodes_list retry errore: {e}")
+    if resp.status_code == 404:
+        # Pagina sparita: la mappatura MAL -> URL e la lista episodi salvata non sono più valide
+        forget_mal_mapping_url(anime_url)
+        scraper_cache.drop_cached(EPISODES_STORE, anime_url)
     resp.raise_for_status()
-    soup = BeautifulSoup(resp.text, "html.parser")
+    soup = parse_html(resp.text, "a", class_=EP_CLASS_RE)
     episodes = []
     for a in soup.select("a.bottone-ep"):
         title = a.get_text(strip=True)
@@ -387,30 +668,169 @@ def get_episodes_list(anime_url, session: Optional[requests.Session] = None):
         else:
             url = BASE_URL + href
         episodes.append({"title": title, "url": url})
+    if episodes:
+        status_match = ANIME_STATUS_RE.search(resp.text)
+        finished = bool(status_match and status_match.group(1).strip().lower().startswith(FINISHED_STATUSES))
+        debug(f"get_episodes_list: {len(episodes)} episodi, stato={status_match.group(1).strip() if status_match else '?'}")
+        scraper_cache.put_cached(EPISODES_STORE, anime_url, {"episodes": episodes, "finished": finished},
+                                 ttl=EPISODES_TTL_FINISHED if finished else EPISODES_TTL_AIRING)
     return episodes
 
-def download_mp4(mp4_url, referer_url, filename=None):
+def _probe_download(session: requests.Session, mp4_url, headers):
+    """Restituisce (dimensione, supporto Range) del file remoto; (None, False) se non determinabile."""
+    try:
+        r = session.head(mp4_url, headers=headers, timeout=TIMEOUT, allow_redirects=True)
+        size = int(r.headers.get("Content-Length") or 0)
+        if r.ok and size and r.headers.get("Accept-Ranges", "").lower() == "bytes":
+            return size, True
+    except (requests.exceptions.RequestException, ValueError) as e:
+        debug(f"download probe HEAD errore: {e}")
+    # Alcuni CDN non rispondono bene a HEAD: prova con il primo byte
+    try:
+        r = session.get(mp4_url, headers={**headers, "Range": "bytes=0-0"}, timeout=TIMEOUT, stream=True)
+        r.close()
+        total = r.headers.get("Content-Range", "").rpartition("/")[2]
+        if r.status_code == 206 and total.isdigit():
+            return int(total), True
+        return int(r.headers.get("Content-Length") or 0) or None, False
+    except (requests.exceptions.RequestException, ValueError) as e:
+        debug(f"download probe Range errore: {e}")
+    return None, False
+
+_PWRITE_LOCK = threading.Lock()
+
+def _pwrite(fd, data, offset):
+    if hasattr(os, "pwrite"):
+        return os.pwrite(fd, data, offset)
+    with _PWRITE_LOCK:  # Windows: niente scritture posizionali
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.write(fd, data)
+
+def download_mp4(mp4_url, referer_url, filename=None, workers: Optional[int] = None):
+    """Scarica il file a range paralleli in un file preallocato, con ripresa da file .progress.
+    Se il server non supporta Range ripiega sul download a flusso singolo."""
     headers = {
         "User-Agent": USER_AGENT,
         "Referer": referer_url
     }
     if not filename:
         filename = mp4_url.split("/")[-1].split("?")[0]
+    workers = max(1, workers or DOWNLOAD_WORKERS)
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
     print(f"\n⬇️ Download in corso: {filename}\n")
-    r = requests.get(mp4_url, headers=headers, stream=True)
-    r.raise_for_status()
-    with open(filename, "wb") as f:
-        for chunk in r.iter_content(chunk_size=8192):
-            if chunk:
-                f.write(chunk)
+
+    size, ranged = _probe_download(session, mp4_url, headers)
+    if not size or not ranged:
+        debug(f"download: range non supportati (size={size}), flusso singolo")
+        r = session.get(mp4_url, headers=headers, stream=True, timeout=TIMEOUT)
+        r.raise_for_status()
+        with open(filename, "wb", buffering=DOWNLOAD_BUFFER) as f:
+            for chunk in r.iter_content(chunk_size=DOWNLOAD_BUFFER):
+                if chunk:
+                    f.write(chunk)
+        print(f"✅ Download completato: {filename}\n")
+        return filename
+
+    # Sidecar di avanzamento: chunk completati, valido solo per stesso URL base / dimensione / chunk
+    progress_path = filename + ".progress"
+    chunk_size = DOWNLOAD_CHUNK
+    url_key = mp4_url.split("?")[0]
+    done = set()
+    try:
+        with open(progress_path, encoding="utf-8") as f:
+            prog = json.load(f)
+        if prog.get("url") == url_key and prog.get("size") == size and prog.get("chunk") == chunk_size \
+                and os.path.exists(filename) and os.path.getsize(filename) == size:
+            done = set(prog.get("done", []))
+            print(f"↩️ Ripresa download: {len(done)} blocchi già completati")
+    except (OSError, ValueError):
+        pass
+    chunks = [(i, i * chunk_size, min(size, (i + 1) * chunk_size) - 1)
+              for i in range((size + chunk_size - 1) // chunk_size)]
+    pending = [c for c in chunks if c[0] not in done]
+    progress_lock = threading.Lock()
+
+    def save_progress():
+        tmp = progress_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"url": url_key, "size": size, "chunk": chunk_size, "done": sorted(done)}, f)
+        os.replace(tmp, progress_path)
+
+    if not done:
+        with open(filename, "wb") as f:
+            f.truncate(size)  # preallocazione
+        save_progress()
+    fd = os.open(filename, os.O_WRONLY | getattr(os, "O_BINARY", 0))
+
+    def fetch_chunk(chunk):
+        idx, start, end = chunk
+        for attempt in range(DOWNLOAD_RETRIES):
+            pos = start
+            try:
+                r = session.get(mp4_url, headers={**headers, "Range": f"bytes={start}-{end}"},
+                                stream=True, timeout=TIMEOUT)
+                if r.status_code != 206:
+                    raise RuntimeError(f"HTTP {r.status_code} per range {start}-{end}")
+                for data in r.iter_content(chunk_size=DOWNLOAD_BUFFER):
+                    if data:
+                        _pwrite(fd, data, pos)
+                        pos += len(data)
+                if pos != end + 1:
+                    raise RuntimeError(f"range {start}-{end} incompleto ({pos - start} byte)")
+                with progress_lock:
+                    done.add(idx)
+                    save_progress()
+                return
+            except Exception as e:
+                debug(f"download blocco {idx} tentativo {attempt + 1}/{DOWNLOAD_RETRIES} fallito: {e}")
+                time.sleep(1 + attempt)
+        raise RuntimeError(f"download blocco {idx} fallito dopo {DOWNLOAD_RETRIES} tentativi")
+
+    try:
+        with ThreadPoolExecutor(max_workers=min(workers, max(1, len(pending)))) as executor:
+            for fut in as_completed([executor.submit(fetch_chunk, c) for c in pending]):
+                fut.result()
+    finally:
+        os.close(fd)
+    os.remove(progress_path)
     print(f"✅ Download completato: {filename}\n")
+    return filename
 
 ## RIMOSSO: ricerca HTML separata (non più necessaria con bypass robusto)
 
+def get_mal_mapping(mal_id):
+    """Risultati già verificati per `mal_id`, se salvati con il dominio attuale."""
+    entry = scraper_cache.get_cached(MAL_MAP_STORE, str(mal_id))
+    if not isinstance(entry, dict):
+        return None
+    if entry.get("domain") != BASE_HOST:
+        debug(f"mappatura MAL {mal_id} scartata: dominio {entry.get('domain')} != {BASE_HOST}")
+        scraper_cache.drop_cached(MAL_MAP_STORE, str(mal_id))
+        return None
+    return entry.get("items") or None
+
+def save_mal_mapping(mal_id, items):
+    scraper_cache.put_cached(MAL_MAP_STORE, str(mal_id), {"domain": BASE_HOST, "items": items},
+                             ttl=MAL_MAP_TTL or None)
+
+def forget_mal_mapping_url(anime_url):
+    """Rimuove ogni mappatura MAL che contiene `anime_url`."""
+    def _mutate(data):
+        for key, rec in list(data.items()):
+            items = ((rec or {}).get("value") or {}).get("items") or []
+            if any(i.get("url") == anime_url for i in items):
+                debug(f"mappatura MAL {key} invalidata (404 su {anime_url})")
+                del data[key]
+    scraper_cache.update_store(MAL_MAP_STORE, _mutate)
+
 def search_anime_by_title_or_malid(title, mal_id, session: Optional[requests.Session] = None):
     debug(f"INIZIO: title={title}, mal_id={mal_id}")
     if session is None:
         session = requests.Session()
+        scraper_cache.load_cookies(BASE_HOST, session)
 
     def fetch_with_challenge(url: str, max_challenge: int = 2):
         """Recupera una pagina anime gestendo eventuale challenge ASFast e restituisce BeautifulSoup o None."""
@@ -439,36 +859,64 @@ def search_anime_by_title_or_malid(title, mal_id, session: Optional[requests.Ses
                     break
             # Se 200 normale
             if status == 200:
-                return BeautifulSoup(r.text, 'html.parser')
+                # Serve solo il link myanimelist
+                return parse_html(r.text, "a", href=MAL_HREF_RE)
             debug(f"fetch_with_challenge status={status} non gestito url={url}")
             break
         return None
 
+    def item_matches_mal_id(item, target_mal_id, stop: threading.Event) -> bool:
+        """Scarica la pagina anime di `item` e verifica il link myanimelist."""
+        if stop.is_set():
+            return False
+        try:
+            soup = fetch_with_challenge(item["url"])
+            if soup is None:
+                debug(f"Errore fetch '{item['title']}' (soup None)")
+                return False
+            mal_btn = soup.find("a", href=MAL_HREF_RE)
+            if mal_btn:
+                found_id_match = MAL_HREF_RE.search(mal_btn["href"])
+                if found_id_match:
+                    found_id = found_id_match.group(1)
+                    debug(f"-> Controllo '{item['title']}': trovato MAL ID {found_id} (cerco {target_mal_id})")
+                    if found_id == str(target_mal_id):
+                        debug("MATCH TROVATO!")
+                        return True
+        except Exception as e:
+            debug(f"Errore visitando '{item['title']}': {e}")
+        return False
+
     # Helper function to check a list of results for a MAL ID match
     def check_results_for_mal_id(results_list, target_mal_id, search_step_name):
         if not results_list:
             debug(f"{search_step_name}: Nessun risultato da controllare.")
             return None
-        
-        debug(f"{search_step_name}: Controllo {len(results_list)} risultati...")
-        matched_items = []
-        for item in results_list:
-            try:
-                soup = fetch_with_challenge(item["url"])
-                if soup is None:
-                    debug(f"Errore fetch '{item['title']}' (soup None)")
-                    continue
-                mal_btn = soup.find("a", href=re.compile(r"myanimelist\.net/anime/(\d+)"))
-                if mal_btn:
-                    found_id_match = re.search(r"myanimelist\.net/anime/(\d+)", mal_btn["href"])
-                    if found_id_match:
-                        found_id = found_id_match.group(1)
-                        debug(f"-> Controllo '{item['title']}': trovato MAL ID {found_id} (cerco {target_mal_id})")
-                        if found_id == str(target_mal_id):
-                            debug("MATCH TROVATO!")
-                            matched_items.append(item)
-            except Exception as e:
-                debug(f"Errore visitando '{item['title']}': {e}")
+
+        debug(f"{search_step_name}: Controllo {len(results_list)} risultati (workers={MAL_CHECK_WORKERS})...")
+        # Verifiche in parallelo; l'ordine dei risultati resta quello della ricerca.
+        # Ci si ferma appena i primi MAL_MAX_MATCHES match (in ordine) sono certi.
+        outcome = [None] * len(results_list)
+        stop = threading.Event()
+        done = _daemon_map(lambda item: item_matches_mal_id(item, target_mal_id, stop),
+                           results_list, MAL_CHECK_WORKERS, stop)
+        for _ in results_list:
+            idx, res, _err = done.get()
+            outcome[idx] = bool(res)
+            if MAL_MAX_MATCHES <= 0:
+                continue
+            found = 0
+            for res in outcome:
+                if res is None:
+                    break
+                if res:
+                    found += 1
+            if found >= MAL_MAX_MATCHES:
+                debug(f"{search_step_name}: {found} match sufficienti, annullo le verifiche restanti")
+                stop.set()
+                break
+        # Il limite serve solo ad annullare le verifiche: si restituiscono tutti i match già certi
+        matched_items = [item for item, res in zip(results_list, outcome) if res]
         if matched_items:
             return matched_items
         debug(f"{search_step_name}: Nessun match trovato.")
@@ -476,6 +924,12 @@ def search_anime_by_title_or_malid(title, mal_id, session: Optional[requests.Ses
 
     # --- Fallback Chain ---
 
+    # 0. Mappatura MAL -> URL salvata da una verifica precedente
+    cached = get_mal_mapping(mal_id)
+    if cached:
+        debug(f"mappatura MAL {mal_id} da cache: {cached}")
+        return cached
+
     # 1. Ricerca diretta per titolo completo
     direct_results = search_anime(title, session=session)
     matches = check_results_for_mal_id(direct_results, mal_id, "Ricerca Diretta") or []
@@ -489,11 +943,55 @@ def search_anime_by_title_or_malid(title, mal_id, session: Optional[requests.Ses
             if m['url'] not in seen:
                 deduped.append(m)
                 seen.add(m['url'])
+        save_mal_mapping(mal_id, deduped)
         return deduped
 
     debug("NESSUN MATCH TROVATO.")
     return []
 
+def build_stremio_stream(stream_url, watch_url, mfp_proxy_url=None, mfp_proxy_password=None):
+    """Oggetto stream per Stremio; gli m3u8 passano da MediaFlow Proxy se configurato."""
+    if not stream_url:
+        return {"url": stream_url}
+    if stream_url.endswith('.m3u8') and mfp_proxy_url and mfp_proxy_password:
+        mfp_url_normalized = mfp_proxy_url.replace('https://','').replace('http://','')
+        if mfp_url_normalized.endswith('/'):
+            mfp_url_normalized = mfp_url_normalized[:-1]
+        proxy_url = f"https://{mfp_url_normalized}/proxy/hls/manifest.m3u8?d={stream_url}&api_password={mfp_proxy_password}"
+        return {"url": proxy_url, "headers": {"Referer": watch_url, "User-Agent": USER_AGENT}}
+    return {"url": stream_url, "headers": {"Referer": watch_url, "User-Agent": USER_AGENT}}
+
+def select_episode(episodes, episode_number=None):
+    """Stessa selezione del provider TS: primo episodio se numero assente,
+    altrimenti match su 'E<n>' nel titolo o, in mancanza del pattern, sul numero contenuto."""
+    if not episodes:
+        return None
+    if episode_number is None:
+        return episodes[0]
+    for ep in episodes:
+        m = re.search(r'E(\d+)', ep["title"], re.I)
+        if m:
+            if int(m.group(1)) == episode_number:
+                return ep
+        elif str(episode_number) in ep["title"]:
+            return ep
+    return None
+
+def resolve_episode(anime_url, episode_number=None, session: Optional[requests.Session] = None,
+                    mfp_proxy_url=None, mfp_proxy_password=None):
+    """Lista episodi -> pagina watch -> link finale in un solo processo e con una sola sessione."""
+    if session is None:
+        session = SESSION
+    episodes = get_episodes_list(anime_url, session=session)
+    episode = select_episode(episodes, episode_number)
+    if not episode:
+        debug(f"resolve: episodio {episode_number} non trovato in {anime_url} ({len(episodes)} episodi)")
+        return {"url": None, "episode": None}
+    watch_url, stream_url = resolve_stream_url(episode["url"], session=session)
+    stremio_stream = build_stremio_stream(stream_url, watch_url, mfp_proxy_url, mfp_proxy_password)
+    stremio_stream["episode"] = episode["title"]
+    return stremio_stream
+
 def main():
     print("🎬 === AnimeSaturn MP4 Link Extractor === 🎬")
     print("Estrae il link MP4 diretto dagli episodi di animesaturn.cx\n")
@@ -566,6 +1064,7 @@ def main_cli():
     search_parser = subparsers.add_parser("search", help="Search for an anime")
     search_parser.add_argument("--query", required=True, help="Anime title to search for")
     search_parser.add_argument("--mal-id", required=False, help="MAL ID to match in fallback search")
+    search_parser.add_argument("--refresh-cache", action="store_true", help=argparse.SUPPRESS)
 
     # Get episodes command
     episodes_parser = subparsers.add_parser("get_episodes", help="Get episode list for an anime")
@@ -577,9 +1076,20 @@ def main_cli():
     stream_parser.add_argument("--mfp-proxy-url", required=False, help="MediaFlow Proxy URL for m3u8 streams")
     stream_parser.add_argument("--mfp-proxy-password", required=False, help="MediaFlow Proxy Password for m3u8 streams")
 
+    # Resolve command: get_episodes + get_stream in un solo processo
+    resolve_parser = subparsers.add_parser("resolve", help="Resolve an episode number of an anime to its stream")
+    resolve_parser.add_argument("--anime-url", required=True, help="AnimeSaturn URL of the anime")
+    resolve_parser.add_argument("--episode", required=False, type=int, help="Episode number (default: first episode)")
+    resolve_parser.add_argument("--mfp-proxy-url", required=False, help="MediaFlow Proxy URL for m3u8 streams")
+    resolve_parser.add_argument("--mfp-proxy-password", required=False, help="MediaFlow Proxy Password for m3u8 streams")
+
     args = parser.parse_args()
 
     if args.command == "search":
+        if args.refresh_cache:
+            # Refresh in background avviato da search_anime su un risultato stale
+            refresh_search_cache(args.query, session=SESSION)
+            return
         if getattr(args, "mal_id", None):
             results = search_anime_by_title_or_malid(args.query, args.mal_id, session=SESSION)
         else:
@@ -591,24 +1101,17 @@ def main_cli():
         print(json.dumps(results, indent=2))
         return
     if args.command == "get_stream":
-        watch_url = get_watch_url(args.episode_url, session=SESSION)
-        stream_url = extract_mp4_url(watch_url, session=SESSION) if watch_url else None
-        stremio_stream = None
-        if stream_url:
-            if stream_url.endswith('.m3u8'):
-                mfp_proxy_url = getattr(args, "mfp_proxy_url", None)
-                mfp_proxy_password = getattr(args, "mfp_proxy_password", None)
-                if mfp_proxy_url and mfp_proxy_password:
-                    mfp_url_normalized = mfp_proxy_url.replace('https://','').replace('http://','')
-                    if mfp_url_normalized.endswith('/'):
-                        mfp_url_normalized = mfp_url_normalized[:-1]
-                    proxy_url = f"https://{mfp_url_normalized}/proxy/hls/manifest.m3u8?d={stream_url}&api_password={mfp_proxy_password}"
-                    stremio_stream = {"url": proxy_url, "headers": {"Referer": watch_url, "User-Agent": USER_AGENT}}
-                else:
-                    stremio_stream = {"url": stream_url, "headers": {"Referer": watch_url, "User-Agent": USER_AGENT}}
-            else:
-                stremio_stream = {"url": stream_url, "headers": {"Referer": watch_url, "User-Agent": USER_AGENT}}
-        print(json.dumps(stremio_stream if stremio_stream else {"url": stream_url}, indent=2))
+        watch_url, stream_url = resolve_stream_url(args.episode_url, session=SESSION)
+        stremio_stream = build_stremio_stream(stream_url, watch_url,
+                                              getattr(args, "mfp_proxy_url", None),
+                                              getattr(args, "mfp_proxy_password", None))
+        print(json.dumps(stremio_stream, indent=2))
+        return
+    if args.command == "resolve":
+        stremio_stream = resolve_episode(args.anime_url, args.episode, session=SESSION,
+                                         mfp_proxy_url=getattr(args, "mfp_proxy_url", None),
+                                         mfp_proxy_password=getattr(args, "mfp_proxy_password", None))
+        print(json.dumps(stremio_stream, indent=2))
         return
 
 if __name__ == "__main__":
@@ -7,14 +7,26 @@ Dipendenze: requests, beautifulsoup4 (pip install requests beautifulsoup4)
 """
 
 import requests
+import urllib3
 import json
 import re
 import time
 import argparse
 import sys
-from bs4 import BeautifulSoup
-from urllib.parse import urlparse, urljoin, unquote
+import threading
+import queue
+import subprocess
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from bs4 import BeautifulSoup, SoupStrainer
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib.parse import urlparse, urljoin, unquote, parse_qs
 import json, os
+
+import scraper_cache
+
 with open(os.path.join(os.path.dirname(__file__), '../../config/domains.json'), encoding='utf-8') as f:
     DOMAINS = json.load(f)
 BASE_URL = f"https://www.{DOMAINS['animeunity']}"
@@ -28,16 +40,118 @@ HEADERS = {
     "Upgrade-Insecure-Requests": "1"
 }
 TIMEOUT = 20
+# info_api restituisce al massimo 120 episodi per richiesta
+EPISODES_RANGE = 120
+EPISODES_WORKERS = int(os.getenv("ANIMEUNITY_EPISODES_WORKERS", "4"))
+# Lista episodi persistente per anime id (aggiornata in delta su episodes_count)
+# Un file per anime (liste da migliaia di episodi: niente JSON unico riletto/riscritto per intero),
+# record con TTL così da essere potati e riscaricati interamente ogni tanto
+EPISODES_STORE = 'animeunity_episodes'
+EPISODES_TTL = int(os.getenv("ANIMEUNITY_EPISODES_TTL", str(30 * 24 * 3600)))
+# Link VixCloud per episodio, validi fino a poco prima di expires=
+STREAMS_STORE = 'animeunity_streams'
+STREAMS_EXPIRY_MARGIN = int(os.getenv("ANIMEUNITY_STREAM_EXPIRY_MARGIN", "300"))
+# Indice locale dell'archivio (opzionale): risposta locale solo per un titolo esatto in un indice
+# recente, altrimenti ricerca remota. Il refresh è una scansione completa (ripresa da checkpoint)
+INDEX_ENABLED = os.getenv("ANIMEUNITY_LOCAL_INDEX", "0") == "1"
+INDEX_STORE = 'animeunity_index'
+INDEX_KEY = 'archive'
+INDEX_WORKERS = int(os.getenv("ANIMEUNITY_INDEX_WORKERS", "4"))
+INDEX_REFRESH_INTERVAL = int(os.getenv("ANIMEUNITY_INDEX_REFRESH", str(24 * 3600)))
+INDEX_SPAWN_GRACE = 10 * 60
+INDEX_MIN_SCORE = float(os.getenv("ANIMEUNITY_INDEX_MIN_SCORE", "0.8"))
+INDEX_MAX_RESULTS = 30
+_INDEX_MEMO = {"value": None, "ts": 0.0, "spawned": False}
+_INDEX_LOCK = threading.Lock()
+# Token CSRF + cookie di sessione: in memoria e su disco, rinnovati a scadenza o su 419/403
+TOKENS_STORE = 'animeunity_tokens'
+TOKENS_TTL = int(os.getenv("ANIMEUNITY_TOKENS_TTL", str(60 * 60)))
+_TOKENS_MEMO = {"data": None, "exp": 0.0}
+_TOKENS_LOCK = threading.RLock()
+# Sessione condivisa (keep-alive) per tutte le chiamate: animeunity + vixcloud, API parallele
+POOL_CONNECTIONS = int(os.getenv("ANIMEUNITY_POOL_CONNECTIONS", "4"))
+POOL_MAXSIZE = int(os.getenv("ANIMEUNITY_POOL_MAXSIZE", "16"))
+HTTP_RETRIES = int(os.getenv("ANIMEUNITY_HTTP_RETRIES", "2"))
+# VixCloud viene chiamato con verify=False: warning disabilitato una volta sola
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+# Statistiche riuso connessioni (stampate a fine comando CLI)
+CONN_STATS = {"requests": 0, "new_connections": 0}
+_CONN_STATS_LOCK = threading.Lock()
+
+def _count_stat(key):
+    with _CONN_STATS_LOCK:
+        CONN_STATS[key] += 1
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        _count_stat("new_connections")
+        return super()._new_conn()
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        _count_stat("new_connections")
+        return super()._new_conn()
+
+class _PooledAdapter(HTTPAdapter):
+    """HTTPAdapter che conta le nuove connessioni aperte dal pool."""
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
 
-def get_session_tokens():
-    """Recupera token di sessione per le richieste API"""
-    response = requests.get(f"{BASE_URL}/", headers=HEADERS, timeout=TIMEOUT)
+def _build_session():
+    session = requests.Session()
+    # Retry solo su errori di connessione / 5xx transitori delle GET; le POST di ricerca
+    # gestiscono già il rinnovo token su 403/419 in _post_search
+    retry = Retry(
+        total=HTTP_RETRIES,
+        connect=HTTP_RETRIES,
+        read=1,
+        backoff_factor=0.3,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        raise_on_status=False,
+    )
+    adapter = _PooledAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.hooks["response"].append(lambda r, *a, **kw: _count_stat("requests"))
+    return session
+
+SESSION = _build_session()
+
+def get_session_tokens(force_refresh=False):
+    """Recupera token di sessione per le richieste API (cache memoria -> disco -> homepage)"""
+    # Varianti di ricerca parallele: una sola GET homepage anche a cache vuota
+    with _TOKENS_LOCK:
+        return _get_session_tokens(force_refresh)
+
+def _get_session_tokens(force_refresh):
+    now = time.time()
+    if not force_refresh:
+        if _TOKENS_MEMO["data"] and now < _TOKENS_MEMO["exp"]:
+            return _TOKENS_MEMO["data"]
+        rec = scraper_cache.get_record(TOKENS_STORE, BASE_URL)
+        if scraper_cache.is_fresh(rec, now):
+            _TOKENS_MEMO.update(data=_build_session_data(rec["value"]["csrf_token"], rec["value"]["cookies"]),
+                                exp=rec["exp"])
+            return _TOKENS_MEMO["data"]
+
+    response = SESSION.get(f"{BASE_URL}/", headers=HEADERS, timeout=TIMEOUT)
     response.raise_for_status()
 
     soup = BeautifulSoup(response.text, "html.parser")
     csrf_token = soup.select_one("meta[name=csrf-token]")["content"]
     cookies = response.cookies.get_dict()
 
+    scraper_cache.put_cached(TOKENS_STORE, BASE_URL, {"csrf_token": csrf_token, "cookies": cookies}, ttl=TOKENS_TTL)
+    _TOKENS_MEMO.update(data=_build_session_data(csrf_token, cookies), exp=now + TOKENS_TTL)
+    return _TOKENS_MEMO["data"]
+
+def _build_session_data(csrf_token, cookies):
     return {
         "csrf_token": csrf_token,
         "cookies": cookies,
@@ -50,8 +164,56 @@ def get_session_tokens():
         }
     }
 
+def refresh_session_tokens(stale_data):
+    """Rinnova i token dopo un 419/403; se un altro thread li ha già rinnovati riusa quelli."""
+    with _TOKENS_LOCK:
+        if _TOKENS_MEMO["data"] is not None and _TOKENS_MEMO["data"] is not stale_data \
+                and time.time() < _TOKENS_MEMO["exp"]:
+            return _TOKENS_MEMO["data"]
+        return get_session_tokens(force_refresh=True)
+
+def _post_endpoint(endpoint, session_data):
+    """POST JSON su un endpoint API (rinnovo token su 403/419); solleva eccezione su errore."""
+    response = SESSION.post(
+        endpoint["url"],
+        json=endpoint["payload"],
+        headers=session_data["session_headers"],
+        cookies=session_data["cookies"],
+        timeout=TIMEOUT
+    )
+    if response.status_code in (403, 419):
+        # Token/sessione in cache scaduti lato server: rinnova e ripeti una volta
+        print(f"Debug: HTTP {response.status_code} da {endpoint['url']}, rinnovo token", file=sys.stderr)
+        session_data = refresh_session_tokens(session_data)
+        response = SESSION.post(
+            endpoint["url"],
+            json=endpoint["payload"],
+            headers=session_data["session_headers"],
+            cookies=session_data["cookies"],
+            timeout=TIMEOUT
+        )
+    response.raise_for_status()
+    return response.json()
+
+def _post_search(endpoint, session_data):
+    """POST su un endpoint di ricerca; restituisce i record (lista vuota su errore)."""
+    try:
+        data = _post_endpoint(endpoint, session_data)
+        print(f"Debug: Risposta da {endpoint['url']}: {data.get('records', [])[:2]}", file=sys.stderr)
+        return data.get("records", []) or []
+    except Exception as e:
+        # Print error to stderr so it doesn't interfere with JSON output
+        print(f"⚠️ Errore ricerca {endpoint['url']}: {e}", file=sys.stderr)
+        return []
+
 def search_anime(query, dubbed=False):
     """Ricerca anime tramite API livesearch e archivio"""
+    if INDEX_ENABLED:
+        local = search_local_index(query, dubbed)
+        if local:
+            print(f"Debug: Trovati {len(local)} risultati per '{query}' nell'indice locale", file=sys.stderr)
+            return local
+
     try:
         session_data = get_session_tokens()
     except Exception as e:
@@ -71,98 +233,362 @@ def search_anime(query, dubbed=False):
         }}
     ]
 
-    for endpoint in search_endpoints:
-        try:
-            response = requests.post(
-                endpoint["url"],
-                json=endpoint["payload"],
-                headers=session_data["session_headers"],
-                cookies=session_data["cookies"],
-                timeout=TIMEOUT
-            )
-            response.raise_for_status()
-            
-            data = response.json()
-            print(f"Debug: Risposta da {endpoint['url']}: {data.get('records', [])[:2]}", file=sys.stderr)
-
-            for record in data.get("records", []):
-                if not record or not record.get("id"):
-                    continue
-                anime_id = record["id"]
-                if anime_id not in seen_ids:
-                    seen_ids.add(anime_id)
-                    title = (record.get("title_it") or
-                            record.get("title_eng") or
-                            record.get("title") or "")
-                    if title.strip():
-                        results.append({
-                            "id": anime_id,
-                            "slug": record.get("slug", ""),
-                            "name": title.strip(),
-                            "episodes_count": record.get("episodes_count", 0)
-                        })
-        except Exception as e:
-            # Print error to stderr so it doesn't interfere with JSON output
-            print(f"⚠️ Errore ricerca {endpoint['url']}: {e}", file=sys.stderr)
-            continue
+    # Le due API sono indipendenti: richieste in parallelo, unione nell'ordine degli endpoint
+    pending = [_in_daemon(_post_search, ep, session_data) for ep in search_endpoints]
+    responses = [out.get()[0] or [] for out in pending]
+
+    if INDEX_ENABLED:
+        # Miss locale: i record remoti aggiornano l'indice
+        _index_upsert([record for records in responses for record in records])
+
+    for records in responses:
+        for record in records:
+            if not record or not record.get("id"):
+                continue
+            anime_id = record["id"]
+            if anime_id not in seen_ids:
+                seen_ids.add(anime_id)
+                title = (record.get("title_it") or
+                        record.get("title_eng") or
+                        record.get("title") or "")
+                if title.strip():
+                    results.append({
+                        "id": anime_id,
+                        "slug": record.get("slug", ""),
+                        "name": title.strip(),
+                        "episodes_count": record.get("episodes_count", 0)
+                    })
 
     print(f"Debug: Trovati {len(results)} risultati per '{query}'", file=sys.stderr)
     return results
 
 def search_anime_with_fallback(query, dubbed=False):
-    results = search_anime(query, dubbed)
-    if results:
-        return results
+    """Prova la query originale e, se vuota, le varianti di fallback in parallelo; restituisce
+    il risultato non vuoto con priorità più alta (senza apostrofi > senza parentesi > prime 3 parole)."""
+    variants = [(query, dubbed)]
     # Fallback: senza apostrofi
     if "'" in query or "’" in query:
-        results = search_anime(query.replace("'", "").replace("’", ""))
-        if results:
-            return results
+        variants.append((query.replace("'", "").replace("’", ""), False))
     # Fallback: senza parentesi
     if "(" in query:
-        results = search_anime(query.split("(")[0].strip(), dubbed)
-        if results:
-            return results
+        variants.append((query.split("(")[0].strip(), dubbed))
     # Fallback: prime 3 parole
     words = query.split()
     if len(words) > 3:
-        results = search_anime(" ".join(words[:3]), dubbed)
-        if results:
-            return results
+        variants.append((" ".join(words[:3]), dubbed))
+    variants = [v for i, v in enumerate(variants) if v not in variants[:i]]
+    if len(variants) == 1:
+        return search_anime(*variants[0])
+
+    # Caso comune: la query originale ha risultati, nessuna richiesta in più
+    results = search_anime(*variants[0])
+    if results or len(variants) == 1:
+        return results
+
+    # Varianti di fallback in parallelo su thread daemon: la prima non vuota in ordine di
+    # priorità vince e le altre, ancora in volo, non ritardano l'uscita del processo
+    fallbacks = variants[1:]
+    pending = [_in_daemon(search_anime, q, d) for q, d in fallbacks]
+    for (q, _), out in zip(fallbacks, pending):
+        res, err = out.get()
+        if err is not None:
+            print(f"⚠️ Errore variante '{q}': {err}", file=sys.stderr)
+        if res:
+            return res
     return []
 
-def get_episodes_list(anime_id):
-    """Recupera lista episodi tramite API info_api"""
+def _in_daemon(fn, *args):
+    """Esegue fn(*args) su un thread daemon; la coda restituita riceve (risultato, eccezione)."""
+    out = queue.Queue(maxsize=1)
+
+    def _run():
+        try:
+            out.put((fn(*args), None))
+        except Exception as e:
+            out.put((None, e))
+    threading.Thread(target=_run, daemon=True).start()
+    return out
+
+# ---------------------- INDICE LOCALE ARCHIVIO ----------------------
+
+def _normalize_title(text):
+    """Titolo in minuscolo, senza accenti né punteggiatura, spazi compattati."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    return " ".join(re.sub(r"[\W_]+", " ", text).split())
+
+def _trigrams(text):
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _index_entry(record):
+    """Voce dell'indice da un record archivio/livesearch (None se senza id o titolo)."""
+    titles = [record.get("title_it"), record.get("title_eng"), record.get("title")]
+    name = next((t.strip() for t in titles if t and t.strip()), "")
+    if not record.get("id") or not name:
+        return None
+    keys = []
+    for title in titles:
+        key = _normalize_title(title)
+        if key and key not in keys:
+            keys.append(key)
+    return {
+        "id": record["id"],
+        "slug": record.get("slug", ""),
+        "name": name,
+        "episodes_count": record.get("episodes_count", 0),
+        "dubbed": bool(record.get("dub")),
+        # Titoli normalizzati, delimitati da spazi: i trigrammi non attraversano due titoli
+        "keys": "|".join(f" {k} " for k in keys),
+    }
+
+def load_archive_index():
+    """Record dell'indice su disco ({"value", "ts"}), letto una volta per processo."""
+    with _INDEX_LOCK:
+        if _INDEX_MEMO["value"] is None:
+            rec = scraper_cache.get_record(INDEX_STORE, INDEX_KEY) or {}
+            _INDEX_MEMO["value"] = rec.get("value") or {}
+            _INDEX_MEMO["ts"] = rec.get("ts") or 0.0
+        return _INDEX_MEMO
+
+def search_local_index(query, dubbed=False):
+    """Ricerca fuzzy a trigrammi nell'indice locale.
+    Restituisce None (→ ricerca remota) se l'indice è incompleto o più vecchio di
+    INDEX_REFRESH_INTERVAL, oppure se nessun titolo coincide esattamente con la query:
+    una corrispondenza solo fuzzy potrebbe nascondere titoli nuovi (es. una nuova stagione)."""
+    memo = load_archive_index()
+    _maybe_spawn_index_refresh(memo)
+    index = memo["value"]
+    if not index.get("complete") or time.time() - index.get("crawled_at", 0) > INDEX_REFRESH_INTERVAL:
+        return None
+    normalized = _normalize_title(query)
+    if not normalized:
+        return None
+    query_trigrams = _trigrams(normalized)
+    exact_key = f" {normalized} "
+
+    scored = []
+    exact = False
+    for entry in index.get("records", {}).values():
+        keys = entry["keys"]
+        if exact_key in keys.split("|"):
+            exact = True
+        if normalized in keys:
+            # Come il LIKE %titolo% remoto
+            score = 1.0
+        elif len(normalized) >= 3:
+            score = sum(1 for t in query_trigrams if t in keys) / len(query_trigrams)
+        else:
+            continue
+        if score >= INDEX_MIN_SCORE:
+            scored.append((-score, entry["dubbed"] != dubbed, len(entry["name"]), entry))
+    if not exact:
+        return None
+    scored.sort(key=lambda item: item[:3])
+    return [
+        {"id": e["id"], "slug": e["slug"], "name": e["name"], "episodes_count": e["episodes_count"]}
+        for *_, e in scored[:INDEX_MAX_RESULTS]
+    ]
+
+def _index_upsert(records):
+    """Aggiorna le voci già note o nuove da risultati remoti (solo se l'indice esiste)."""
+    entries = [e for e in (_index_entry(r) for r in records if r) if e]
+    if not entries or not load_archive_index()["value"].get("records"):
+        return
+
+    def _mutate(data):
+        rec = data.get(INDEX_KEY)
+        if not isinstance(rec, dict) or not isinstance(rec.get("value"), dict):
+            return
+        for entry in entries:
+            rec["value"].setdefault("records", {})[str(entry["id"])] = entry
+    scraper_cache.update_store(INDEX_STORE, _mutate)
+
+def _maybe_spawn_index_refresh(memo):
+    """Avvia (una volta per processo) il refresh in background se l'indice manca, è incompleto o vecchio."""
+    with _INDEX_LOCK:
+        if memo["spawned"]:
+            return
+        memo["spawned"] = True
+    index = memo["value"]
+    if index.get("complete") and index.get("offset") is None \
+            and time.time() - index.get("crawled_at", 0) < INDEX_REFRESH_INTERVAL:
+        return
+    claimed = []
+
+    def _mutate(data):
+        rec = data.get(INDEX_KEY)
+        if not isinstance(rec, dict):
+            rec = data[INDEX_KEY] = {"value": {"records": {}, "complete": False, "offset": 0}, "ts": 0, "exp": None}
+        if time.time() - rec.get("refresh_at", 0) > INDEX_SPAWN_GRACE:
+            rec["refresh_at"] = time.time()
+            claimed.append(True)
+    scraper_cache.update_store(INDEX_STORE, _mutate)
+    if not claimed:
+        return
+    try:
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), "index"],
+                         stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                         start_new_session=True)
+    except Exception as e:
+        print(f"⚠️ Avvio refresh indice fallito: {e}", file=sys.stderr)
+
+def _archive_page(offset, session_data):
+    """Una pagina di archivio/get-animes senza filtri; solleva eccezione su errore."""
+    endpoint = {"url": f"{BASE_URL}/archivio/get-animes", "payload": {
+        "title": False, "type": False, "year": False,
+        "order": "Lista A-Z", "status": False, "genres": False,
+        "season": False, "offset": offset, "dubbed": False
+    }}
+    return _post_endpoint(endpoint, session_data).get("records") or []
+
+def _merge_index_page(index, records):
+    """Inserisce una pagina nell'indice; True se ha portato voci nuove o cambiate."""
+    changed = False
+    for record in records:
+        entry = _index_entry(record) if record else None
+        if not entry:
+            continue
+        key = str(entry["id"])
+        if index["records"].get(key) != entry:
+            index["records"][key] = entry
+            changed = True
+    return changed
+
+def _save_index(index):
+    """Salva l'indice (permanente) mantenendo il marcatore refresh_at del record."""
+    def _mutate(data):
+        prev = data.get(INDEX_KEY)
+        rec = {"value": index, "ts": time.time(), "exp": None}
+        if isinstance(prev, dict) and "refresh_at" in prev:
+            rec["refresh_at"] = prev["refresh_at"]
+        data[INDEX_KEY] = rec
+    scraper_cache.update_store(INDEX_STORE, _mutate)
+
+def _crawl_archive(index, session_data):
+    """Scansione completa dell'archivio (A-Z) ripresa dall'offset salvato, a blocchi di
+    INDEX_WORKERS pagine in parallelo con checkpoint dopo ogni blocco."""
+    def _done():
+        index["complete"] = True
+        index["crawled_at"] = time.time()
+        index["offset"] = None
+
+    offset = index["offset"]
+    first = _archive_page(offset, session_data)
+    if not first:
+        _done()
+        return
+    # Dimensione pagina ricavata dalla risposta (l'API non accetta un limite)
+    step = len(first)
+    _merge_index_page(index, first)
+    offset += step
+    index["offset"] = offset
+    with ThreadPoolExecutor(max_workers=INDEX_WORKERS) as executor:
+        while True:
+            offsets = [offset + i * step for i in range(INDEX_WORKERS)]
+            pages = list(executor.map(lambda o: _archive_page(o, session_data), offsets))
+            for page in pages:
+                if not page:
+                    _done()
+                    return
+                _merge_index_page(index, page)
+                offset += step
+            index["offset"] = offset
+            _save_index(index)
+            print(f"Debug: indice archivio {len(index['records'])} anime (offset {offset})", file=sys.stderr)
+
+def refresh_archive_index(full=False):
+    """Costruisce o aggiorna l'indice locale. Un solo processo per volta (refresh_lock)."""
+    with scraper_cache.refresh_lock(INDEX_STORE, INDEX_KEY) as owner:
+        if not owner:
+            print("Debug: refresh indice già in corso in un altro processo", file=sys.stderr)
+            return None
+        rec = scraper_cache.get_record(INDEX_STORE, INDEX_KEY) or {}
+        index = rec.get("value") or {}
+        index.setdefault("records", {})
+        index.setdefault("complete", False)
+        # offset != None: scansione completa in corso (o da riprendere)
+        index.setdefault("offset", 0)
+        if index["offset"] is None:
+            if not full and time.time() - index.get("crawled_at", 0) < INDEX_REFRESH_INTERVAL:
+                return index
+            index["offset"] = 0
+
+        session_data = get_session_tokens()
+        try:
+            _crawl_archive(index, session_data)
+        finally:
+            # Checkpoint anche su errore: la scansione riprende dall'ultimo blocco completato
+            _save_index(index)
+        with _INDEX_LOCK:
+            _INDEX_MEMO.update(value=index, ts=time.time())
+        return index
+
+def _fetch_episode_range(anime_id, start, end):
+    episodes_response = SESSION.get(
+        f"{BASE_URL}/info_api/{anime_id}/1",
+        params={"start_range": start, "end_range": end},
+        headers=HEADERS,
+        timeout=TIMEOUT
+    )
+    episodes_response.raise_for_status()
+    return episodes_response.json().get("episodes", [])
+
+def _fetch_episode_ranges(anime_id, first, total):
+    """Finestre da `first` a `total` in parallelo; restituisce (episodi in ordine, completo)."""
     episodes = []
+    ranges = [(start, min(start + EPISODES_RANGE - 1, total))
+              for start in range(first, total + 1, EPISODES_RANGE)]
+    if not ranges:
+        return episodes, True
+    with ThreadPoolExecutor(max_workers=max(1, min(EPISODES_WORKERS, len(ranges)))) as executor:
+        futures = [executor.submit(_fetch_episode_range, anime_id, start, end) for start, end in ranges]
+        for (start, end), fut in zip(ranges, futures):
+            try:
+                episodes.extend(fut.result())
+            except Exception as e:
+                # Come prima: si restituiscono gli episodi fino alla prima finestra fallita
+                print(f"⚠️ Errore recupero episodi {start}-{end}: {e}", file=sys.stderr)
+                return episodes, False
+    return episodes, True
 
+def _episodes_store(anime_id):
+    return f"{EPISODES_STORE}_{re.sub(r'[^A-Za-z0-9_-]', '', str(anime_id))}"
+
+def get_episodes_list(anime_id):
+    """Recupera lista episodi tramite API info_api (finestre da 120 richieste in parallelo).
+    La lista è salvata per anime: se episodes_count è cresciuto si scarica solo la coda mancante."""
     try:
         # Ottieni conteggio episodi
-        count_response = requests.get(
+        count_response = SESSION.get(
             f"{BASE_URL}/info_api/{anime_id}/",
             headers=HEADERS,
             timeout=TIMEOUT
         )
         count_response.raise_for_status()
         total_episodes = count_response.json().get("episodes_count", 0)
-
-        # Recupera episodi in batch
-        start = 1
-        while start <= total_episodes:
-            end = min(start + 119, total_episodes)
-
-            episodes_response = requests.get(
-                f"{BASE_URL}/info_api/{anime_id}/1",
-                params={"start_range": start, "end_range": end},
-                headers=HEADERS,
-                timeout=TIMEOUT
-            )
-            episodes_response.raise_for_status()
-            episodes.extend(episodes_response.json().get("episodes", []))
-            start = end + 1
-
     except Exception as e:
         print(f"⚠️ Errore recupero episodi: {e}", file=sys.stderr)
+        return []
 
+    # Gli store per anime scaduti (serie non più richieste) non verrebbero mai riscritti né potati
+    scraper_cache.sweep_stores(f"{EPISODES_STORE}_", EPISODES_TTL + scraper_cache.PRUNE_GRACE)
+    store = _episodes_store(anime_id)
+    cached = scraper_cache.get_cached(store, str(anime_id))
+    known = []
+    if isinstance(cached, dict) and len(cached.get("episodes") or []) == cached.get("count"):
+        if cached["count"] == total_episodes:
+            print(f"Debug: episodi {anime_id} da cache ({total_episodes})", file=sys.stderr)
+            return cached["episodes"]
+        if 0 < cached["count"] < total_episodes:
+            known = cached["episodes"]
+            print(f"Debug: episodi {anime_id} aggiornamento coda {cached['count'] + 1}-{total_episodes}", file=sys.stderr)
+
+    new_episodes, complete = _fetch_episode_ranges(anime_id, len(known) + 1, total_episodes)
+    episodes = known + new_episodes
+    if complete and episodes and len(episodes) == total_episodes:
+        scraper_cache.put_cached(store, str(anime_id), {"count": total_episodes, "episodes": episodes},
+                                 ttl=EPISODES_TTL)
     return episodes
 
 def get_video_page_content(anime_id, anime_slug, episode_id):
@@ -170,13 +596,128 @@ def get_video_page_content(anime_id, anime_slug, episode_id):
     episode_url = f"{BASE_URL}/anime/{anime_id}-{anime_slug}/{episode_id}"
 
     try:
-        response = requests.get(episode_url, headers=HEADERS, timeout=TIMEOUT)
+        response = SESSION.get(episode_url, headers=HEADERS, timeout=TIMEOUT)
         response.raise_for_status()
         return response.text
     except Exception as e:
         print(f"⚠️ Errore caricamento pagina episodio: {e}", file=sys.stderr)
         return None
 
+# Scanner unico della pagina embed VixCloud: una sola passata sul testo per le occorrenze
+# di ".mp4" e di "config = {"; ogni stringa tra apici con .mp4 viene classificata dalla
+# chiave che la precede. Priorità come in passato:
+# src_mp4/file -> au-d1 -> scws-content -> mp4Url/videoSource -> window.config
+# ("window.config" contiene "config": basta il letterale, molto più rapido dell'alternanza)
+VIXCLOUD_SCAN_RE = re.compile(r"\.(?i:mp4)|config\s*=\s*(?P<cfg>\{)")
+VIXCLOUD_MEDIA_TAG_RE = re.compile(r"<(?:video|source)\b", re.IGNORECASE)
+VIXCLOUD_KEY_RES = (
+    ("mp4", re.compile(r"(?:src_mp4|file)\s*[:=]\s*$")),
+    ("au", re.compile(r"(?:file|source|src)\s*[:=]\s*$", re.IGNORECASE)),
+    ("var", re.compile(r"(?:mp4|video)(?:Url|Source|File)\s*[:=]\s*$", re.IGNORECASE)),
+)
+VIXCLOUD_TOKEN_GROUPS = ("au", "scws", "var")
+VIXCLOUD_KEY_WINDOW = 64
+VIXCLOUD_CONFIG_RE = re.compile(r'(\{.*?\});', re.DOTALL)
+
+def _vixcloud_config_mp4(full_text, pos):
+    """Ricava il link MP4 dal JSON window.config (playlist M3U8 -> download MP4)."""
+    json_match = VIXCLOUD_CONFIG_RE.match(full_text, pos)
+    if not json_match:
+        return None
+    try:
+        config = json.loads(json_match.group(1))
+    except json.JSONDecodeError:
+        return None
+
+    # Cerca URL base e converti da M3U8 a MP4
+    for key in ["masterPlaylist", "window_parameter", "streams"]:
+        if key in config and isinstance(config[key], dict):
+            base_url = config[key].get("url", "")
+            if "playlist" in base_url and "vixcloud.co" in base_url:
+                # Sostituisci /playlist/ con /download/ per ottenere MP4
+                mp4_url = base_url.replace("/playlist/", "/download/")
+                mp4_url = mp4_url.replace("m3u8", "mp4")
+
+                # Aggiungi parametri di qualità se disponibili
+                params = config[key].get("params", {})
+                if params:
+                    token = params.get("token", "")
+                    expires = params.get("expires", "")
+                    if token and expires:
+                        separator = "&" if "?" in mp4_url else "?"
+                        mp4_url += f"{separator}token={token}&expires={expires}"
+
+                        # Aggiungi qualità se FHD disponibile
+                        if config.get("canPlayFHD", False):
+                            mp4_url += "&quality=1080p"
+
+                        return mp4_url
+    return None
+
+def _vixcloud_soup_mp4(full_text):
+    """Ultima risorsa: tag <video>/<source> con src MP4 firmato."""
+    if not VIXCLOUD_MEDIA_TAG_RE.search(full_text):
+        return None
+    soup = BeautifulSoup(full_text, "html.parser", parse_only=SoupStrainer(["video", "source"]))
+    for tag in soup.find_all(["video", "source"], src=True):
+        src = tag["src"].replace("\\/", "/")
+        if src.startswith("http") and ".mp4" in src and "token=" in src:
+            return src
+    return None
+
+def _vixcloud_categories(full_text, start, url):
+    """Categorie di estrazione a cui appartiene la stringa `url` che inizia dopo l'apice in start-1."""
+    lowered = url.lower()
+    key_from = max(0, start - 1 - VIXCLOUD_KEY_WINDOW)
+    for group, key_re in VIXCLOUD_KEY_RES:
+        if group == "au" and "au-d1-" not in lowered:
+            continue
+        if group == "mp4" and ".mp4" not in url:
+            continue
+        if key_re.search(full_text, key_from, start - 1):
+            yield group
+    if "scws-content.net" in lowered:
+        yield "scws"
+
+def parse_vixcloud_embed(full_text):
+    """Estrae il link MP4 dal testo della pagina embed con una sola scansione regex."""
+    found = {}
+    config_pos = None
+    scanned_to = 0
+    for m in VIXCLOUD_SCAN_RE.finditer(full_text):
+        if m.group("cfg"):
+            if config_pos is None:
+                config_pos = m.start("cfg")
+            continue
+        if m.start() < scanned_to:
+            continue
+        # Stringa tra apici che contiene l'occorrenza di .mp4
+        start = max(full_text.rfind('"', 0, m.start()), full_text.rfind("'", 0, m.start())) + 1
+        end_dq, end_sq = full_text.find('"', m.end()), full_text.find("'", m.end())
+        end = min(e for e in (end_dq, end_sq) if e != -1) if end_dq != -1 or end_sq != -1 else -1
+        if start == 0 or end == -1:
+            continue
+        scanned_to = end
+        clean_url = full_text[start:end].replace("\\/", "/")
+        for group in _vixcloud_categories(full_text, start, full_text[start:end]):
+            if group == "mp4":
+                # Link diretto (logica MP4_downloader): priorità massima, uscita immediata
+                if clean_url.startswith("http"):
+                    return clean_url
+            elif group not in found and "token=" in clean_url and "expires=" in clean_url:
+                found[group] = clean_url
+
+    for group in VIXCLOUD_TOKEN_GROUPS:
+        if group in found:
+            return found[group]
+
+    if config_pos is not None:
+        mp4_url = _vixcloud_config_mp4(full_text, config_pos)
+        if mp4_url:
+            return mp4_url
+
+    return _vixcloud_soup_mp4(full_text)
+
 def extract_mp4_from_vixcloud(embed_url):
     """
     Estrae link MP4 diretto da VixCloud
@@ -192,9 +733,7 @@ def extract_mp4_from_vixcloud(embed_url):
         }
 
         # Richiesta pagina embed con SSL disabilitato
-        import urllib3
-        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-        response = requests.get(
+        response = SESSION.get(
             embed_url,
             headers=vixcloud_headers,
             timeout=TIMEOUT,
@@ -202,86 +741,41 @@ def extract_mp4_from_vixcloud(embed_url):
         )
         response.raise_for_status()
 
-        soup = BeautifulSoup(response.text, "html.parser")
-
-        # Metodo 1: Cerca script con src_mp4 (logica MP4_downloader)
-        scripts = soup.find_all("script")
-        for script in scripts:
-            if script.string:
-                # Pattern per link MP4 diretto
-                mp4_match = re.search(r"(?:src_mp4|file)\s*[:=]\s*[\"']([^\"']+\.mp4[^\"']*)[\"']", script.string)
-                if mp4_match:
-                    mp4_url = mp4_match.group(1)
-                    # Decodifica eventuali escape sequences
-                    mp4_url = mp4_url.replace("\\/", "/")
-                    if mp4_url.startswith("http"):
-                        return mp4_url
-
-        # Metodo 2: Cerca variabili JavaScript con URL MP4
-        full_text = response.text
-        mp4_patterns = [
-            r"(?:file|source|src)\s*[:=]\s*[\"']([^\"']*au-d1-[^\"']*\.mp4[^\"']*)[\"']",
-            r"[\"']([^\"']*scws-content\.net[^\"']*\.mp4[^\"']*)[\"']",
-            r"(?:mp4|video)(?:Url|Source|File)\s*[:=]\s*[\"']([^\"']+\.mp4[^\"']*)[\"']"
-        ]
-
-        for pattern in mp4_patterns:
-            matches = re.findall(pattern, full_text, re.IGNORECASE)
-            for match in matches:
-                clean_url = match.replace("\\/", "/")
-                if "token=" in clean_url and "expires=" in clean_url:
-                    return clean_url
-
-        # Metodo 3: Parsing JSON configuration (fallback per M3U8->MP4)
-        json_match = re.search(r'(?:config|window\.config)\s*=\s*(\{.*?\});', full_text, re.DOTALL)
-        if json_match:
-            try:
-                config = json.loads(json_match.group(1))
-
-                # Cerca URL base e converti da M3U8 a MP4
-                for key in ["masterPlaylist", "window_parameter", "streams"]:
-                    if key in config and isinstance(config[key], dict):
-                        base_url = config[key].get("url", "")
-                        if "playlist" in base_url and "vixcloud.co" in base_url:
-                            # Sostituisci /playlist/ con /download/ per ottenere MP4
-                            mp4_url = base_url.replace("/playlist/", "/download/")
-                            mp4_url = mp4_url.replace("m3u8", "mp4")
-
-                            # Aggiungi parametri di qualità se disponibili
-                            params = config[key].get("params", {})
-                            if params:
-                                token = params.get("token", "")
-                                expires = params.get("expires", "")
-                                if token and expires:
-                                    separator = "&" if "?" in mp4_url else "?"
-                                    mp4_url += f"{separator}token={token}&expires={expires}"
-
-                                    # Aggiungi qualità se FHD disponibile
-                                    if config.get("canPlayFHD", False):
-                                        mp4_url += "&quality=1080p"
-
-                                    return mp4_url
-            except json.JSONDecodeError:
-                pass
-
-        return None
+        return parse_vixcloud_embed(response.text)
 
     except Exception as e:
         print(f"⚠️ Errore estrazione VixCloud: {e}", file=sys.stderr)
         return None
 
+def vixcloud_link_ttl(mp4_url):
+    """Secondi di validità residui del link (parametro expires), meno un margine; 0 se assente."""
+    expires = (parse_qs(urlparse(mp4_url).query).get("expires") or [""])[0]
+    if not expires.isdigit():
+        return 0
+    return int(int(expires) - time.time() - STREAMS_EXPIRY_MARGIN)
+
 def get_stream(anime_id, anime_slug, episode_id):
     """
     Estrae sia embed URL che MP4 link
     Restituisce un dizionario con entrambi i link
     """
+    episode_page_url = f"{BASE_URL}/anime/{anime_id}-{anime_slug}/{episode_id}"
+
+    # Link già estratti e non ancora vicini alla scadenza del token
+    cached = scraper_cache.get_cached(STREAMS_STORE, str(episode_id))
+    if isinstance(cached, dict) and cached.get("mp4_url"):
+        print(f"Debug: link VixCloud episodio {episode_id} da cache", file=sys.stderr)
+        return {
+            "episode_page": episode_page_url,
+            "embed_url": cached.get("embed_url"),
+            "mp4_url": cached["mp4_url"]
+        }
+
     # Ottieni contenuto pagina episodio
     page_content = get_video_page_content(anime_id, anime_slug, episode_id)
     if not page_content:
         return {"embed_url": None, "mp4_url": None, "episode_page": None}
 
-    episode_page_url = f"{BASE_URL}/anime/{anime_id}-{anime_slug}/{episode_id}"
-
     # Cerca embed URL di VixCloud
     soup = BeautifulSoup(page_content, "html.parser")
     embed_url = None
@@ -312,6 +806,10 @@ def get_stream(anime_id, anime_slug, episode_id):
     if embed_url:
         mp4_url = extract_mp4_from_vixcloud(embed_url)
 
+    ttl = vixcloud_link_ttl(mp4_url) if mp4_url else 0
+    if ttl > 0:
+        scraper_cache.put_cached(STREAMS_STORE, str(episode_id), {"embed_url": embed_url, "mp4_url": mp4_url}, ttl=ttl)
+
     return {
         "episode_page": episode_page_url,
         "embed_url": embed_url,
@@ -337,11 +835,11 @@ def main():
     stream_parser.add_argument("--anime-slug", required=True, help="Anime slug")
     stream_parser.add_argument("--episode-id", required=True, help="Episode ID")
 
+    # Build / refresh indice locale archivio
+    index_parser = subparsers.add_parser("index", help="Build or refresh the local archive index")
+    index_parser.add_argument("--full", action="store_true", help="Rescan even if the index is recent")
+
     args = parser.parse_args()
-    
-    # Disable SSL warnings
-    import urllib3
-    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
     if args.command == "search":
         results = search_anime_with_fallback(args.query, args.dubbed)
@@ -352,6 +850,13 @@ def main():
     elif args.command == "get_stream":
         results = get_stream(args.anime_id, args.anime_slug, args.episode_id)
         print(json.dumps(results, indent=4))
+    elif args.command == "index":
+        index = refresh_archive_index(args.full)
+        summary = {"records": len(index["records"]), "complete": index["complete"]} if index else {"busy": True}
+        print(json.dumps(summary, indent=4))
+
+    print(f"Debug: HTTP {args.command}: {CONN_STATS['requests']} richieste, "
+          f"{CONN_STATS['new_connections']} nuove connessioni", file=sys.stderr)
 
 if __name__ == "__main__":
     main()
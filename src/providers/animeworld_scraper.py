@@ -15,11 +15,16 @@ Comandi:
 
 Nota: implementazione minimale derivata dal tuo script root `animeworld.py` per integrazione nel provider TS.
 """
-import argparse, sys, re, json, os, datetime
+import argparse, sys, re, json, os, datetime, html, threading, queue
 from typing import List, Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
 import requests
+import urllib3
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
 
+import scraper_cache
+
 BASE_DIR = os.path.dirname(__file__)
 with open(os.path.join(BASE_DIR, '../../config/domains.json'), encoding='utf-8') as f:
     DOMAINS = json.load(f)
@@ -36,6 +41,33 @@ TITLE_REPL = {
     # lo spazio singolo in Python lo gestiamo dopo (q_norm sostituisce gli spazi con +)
 }
 
+MONTHS_IT = {
+    "Gennaio": "January", "Febbraio": "February", "Marzo": "March",
+    "Aprile": "April", "Maggio": "May", "Giugno": "June",
+    "Luglio": "July", "Agosto": "August", "Settembre": "September",
+    "Ottobre": "October", "Novembre": "November", "Dicembre": "December"
+}
+RELEASE_DATE_RE = re.compile(r'<label>Data di uscita:</label>\s*<span>\s*(.*?)\s*</span>', re.S)
+# Pagine info (data-tip) scaricate in parallelo durante la ricerca con data
+DATE_CHECK_WORKERS = int(os.getenv("ANIMEWORLD_DATE_WORKERS", "6"))
+# slug -> data di uscita (non cambia mai): record permanenti, popolati da ogni pagina scaricata
+RELEASE_DATES_STORE = 'animeworld_release_dates'
+_RELEASE_DATES_MEMO: Dict[str, str] = {}
+_RELEASE_DATES_LOADED = False
+# slug -> [[numero episodio, href], ...] per andare diretti alla pagina episodio in get_stream
+EPISODE_MAP_STORE = 'animeworld_episode_maps'
+EPISODE_MAP_TTL = int(os.getenv("ANIMEWORLD_EPISODE_MAP_TTL", str(7 * 24 * 3600)))
+# Esito HEAD dei link download (404 = link morto), cache breve per URL
+LINK_CHECK_STORE = 'animeworld_link_checks'
+LINK_CHECK_TTL = int(os.getenv("ANIMEWORLD_LINK_CHECK_TTL", "600"))
+ALT_LINK_TAG_RE = re.compile(r'<a\b[^>]*\bid=["\']alternativeDownloadLink["\'][^>]*>', re.I)
+HREF_RE = re.compile(r'\bhref=["\']([^"\']+)["\']', re.I)
+
+# Connessioni keep-alive per host (fetch paralleli di date e link)
+POOL_MAXSIZE = int(os.getenv("ANIMEWORLD_POOL_MAXSIZE", "10"))
+# Le richieste usano verify=False: warning disabilitato una volta sola
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
 UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36"
 
 def rand_headers():
@@ -65,15 +97,107 @@ def security_cookie(text: str):
         return {}
     return {f"SecurityAW-{m.group(1)}": m.group(2)}
 
-def fetch(url: str, cookies=None, allow_retry=True):
-    cookies = cookies or {}
-    r = requests.get(url, headers=rand_headers(), cookies=cookies, timeout=25, verify=False)
+def _build_session() -> requests.Session:
+    """Sessione keep-alive condivisa da search, get_episodes, pagine episodio e HEAD dei link."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(rand_headers())
+    session.verify = False
+    return session
+
+SESSION = _build_session()
+_COOKIES_LOCK = threading.Lock()
+_COOKIES_LOADED = False
+
+def _load_session_cookies():
+    """Cookie SecurityAW salvati dalle invocazioni precedenti, caricati una volta nella sessione."""
+    global _COOKIES_LOADED
+    with _COOKIES_LOCK:
+        if not _COOKIES_LOADED:
+            scraper_cache.load_cookies(AW_HOST, SESSION)
+            _COOKIES_LOADED = True
+
+def fetch(url: str, allow_retry=True):
+    _load_session_cookies()
+    r = SESSION.get(url, timeout=25)
     if allow_retry and r.status_code == 202:
         ck = security_cookie(r.text)
         if ck:
-            cookies.update(ck)
-            r = requests.get(url, headers=rand_headers(), cookies=cookies, timeout=25, verify=False)
-    return r, cookies
+            raw = re.search(r'SecurityAW-[A-Za-z0-9]{2}=[^"\']*', r.text)
+            ttl = scraper_cache.cookie_ttl(raw.group(0)) if raw else None
+            for name, value in ck.items():
+                # Il cookie resta sulla sessione per tutte le richieste successive del processo
+                SESSION.cookies.set(name, value, domain=AW_HOST)
+                scraper_cache.save_cookie(AW_HOST, name, value, ttl)
+            r = SESSION.get(url, timeout=25)
+    if r.ok and '/play/' in url:
+        # Pagine anime / episodio riportano la data di uscita: la salviamo per le ricerche future
+        remember_release_date(play_slug(url), r.text)
+    return r
+
+def play_slug(url_or_path: str) -> str:
+    """Slug anime da /play/<slug>[/<episodio>] (o slug semplice), come in search."""
+    parts = [p for p in url_or_path.split('?')[0].split('/') if p]
+    if 'play' in parts and parts.index('play') + 1 < len(parts):
+        return parts[parts.index('play') + 1]
+    return parts[-1] if parts else ''
+
+def known_release_date(slug: str) -> Optional[str]:
+    global _RELEASE_DATES_LOADED
+    if not _RELEASE_DATES_LOADED:
+        # Store letto una sola volta per processo, anche se vuoto
+        for key, rec in scraper_cache.load_store(RELEASE_DATES_STORE).items():
+            if isinstance(rec, dict) and rec.get('value'):
+                _RELEASE_DATES_MEMO.setdefault(key, rec['value'])
+        _RELEASE_DATES_LOADED = True
+    return _RELEASE_DATES_MEMO.get(slug)
+
+def remember_release_date(slug: str, text: str) -> Optional[str]:
+    """Estrae la data di uscita da `text` e la registra per `slug` se nuova."""
+    release = parse_release_date(text)
+    if slug and release and known_release_date(slug) != release:
+        _RELEASE_DATES_MEMO[slug] = release
+        scraper_cache.put_cached(RELEASE_DATES_STORE, slug, release)
+    return release
+
+def parse_release_date(text: str) -> Optional[str]:
+    """'Data di uscita' di una pagina AnimeWorld come YYYY-MM-DD (None se assente o non valida)."""
+    m = RELEASE_DATE_RE.search(text)
+    if not m:
+        return None
+    release_date = m.group(1).strip()
+    for ita, eng in MONTHS_IT.items():
+        release_date = release_date.replace(ita, eng)
+    try:
+        return datetime.datetime.strptime(release_date, "%d %B %Y").strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+def fetch_release_date(slug: str, info_url: str) -> Optional[str]:
+    known = known_release_date(slug)
+    if known:
+        return known
+    try:
+        resp = fetch(info_url)
+        if resp.ok:
+            return remember_release_date(slug, resp.text)
+    except Exception as e:
+        print(f"[AW-DEBUG] errore data: {e}", file=sys.stderr)
+    return None
+
+def release_date_matches(release_date_fmt: Optional[str], date: str) -> bool:
+    """Confronto data di uscita con tolleranza +/- 1 giorno; senza data nota l'anime è accettato."""
+    if not release_date_fmt:
+        return True
+    try:
+        date_object = datetime.datetime.strptime(date, "%Y-%m-%d")
+    except ValueError:
+        return True
+    return (release_date_fmt == date or
+            release_date_fmt == (date_object + datetime.timedelta(days=1)).strftime("%Y-%m-%d") or
+            release_date_fmt == (date_object - datetime.timedelta(days=1)).strftime("%Y-%m-%d"))
 
 def search(query: str, date: str = None) -> List[Dict[str, Any]]:
     # Normalizza showname come nello script
@@ -81,12 +205,6 @@ def search(query: str, date: str = None) -> List[Dict[str, Any]]:
     q_norm = showname.replace(' ', '+')
     results = []
     seen = set()
-    months = {
-        "Gennaio": "January", "Febbraio": "February", "Marzo": "March",
-        "Aprile": "April", "Maggio": "May", "Giugno": "June",
-        "Luglio": "July", "Agosto": "August", "Settembre": "September",
-        "Ottobre": "October", "Novembre": "November", "Dicembre": "December"
-    }
     # Prima prova con year se data fornita
     year = None
     if date:
@@ -101,49 +219,43 @@ def search(query: str, date: str = None) -> List[Dict[str, Any]]:
     for url in urls:
         try:
             print(f"[AW-DEBUG] Search URL: {url}", file=sys.stderr)
-            r, ck = fetch(url)
+            r = fetch(url)
             if not r.ok:
                 continue
             soup = BeautifulSoup(r.text, 'html.parser')
             posters = soup.find_all('a', class_=['poster', 'tooltipstered'])
+            candidates = []
             for a in posters:
                 href = a.get('href') or ''
                 if not href.startswith('/'):
                     continue
                 slug = href.strip('/').split('/')[-1]
+                if slug in seen or any(c['slug'] == slug for c in candidates):
+                    continue
                 name = a.get('title') or a.text or slug
-                # Filtro per data se fornita
                 anime_info_url = f'{BASE_URL}/{a.get("data-tip")}' if a.get("data-tip") else None
-                match_date = True
-                if date and anime_info_url:
-                    try:
-                        resp, _ = fetch(anime_info_url)
-                        if resp.ok:
-                            pattern = r'<label>Data di uscita:</label>\s*<span>\s*(.*?)\s*</span>'
-                            m = re.search(pattern, resp.text, re.S)
-                            if m:
-                                release_date = m.group(1).strip()
-                                for ita, eng in months.items():
-                                    release_date = release_date.replace(ita, eng)
-                                release_date_object = datetime.datetime.strptime(release_date, "%d %B %Y")
-                                date_object = datetime.datetime.strptime(date, "%Y-%m-%d")
-                                release_date_fmt = release_date_object.strftime("%Y-%m-%d")
-                                # accetta +/- 1 giorno
-                                match_date = (release_date_fmt == date or
-                                              release_date_fmt == (date_object + datetime.timedelta(days=1)).strftime("%Y-%m-%d") or
-                                              release_date_fmt == (date_object - datetime.timedelta(days=1)).strftime("%Y-%m-%d"))
-                                print(f"[AW-DEBUG] {name} release: {release_date_fmt} vs {date} -> {match_date}", file=sys.stderr)
-                    except Exception as e:
-                        print(f"[AW-DEBUG] errore data: {e}", file=sys.stderr)
-                if not match_date:
-                    continue
-                if slug in seen:
-                    continue
-                seen.add(slug)
+                candidates.append({'slug': slug, 'name': name, 'info_url': anime_info_url})
+            # Filtro per data se fornita: date già note da cache, le altre pagine info in parallelo
+            if date:
+                for c in candidates:
+                    c['release'] = known_release_date(c['slug'])
+                to_check = [c for c in candidates if c['info_url'] and not c['release']]
+                if to_check:
+                    with ThreadPoolExecutor(max_workers=min(DATE_CHECK_WORKERS, len(to_check))) as executor:
+                        for c, release in zip(to_check, executor.map(lambda c: fetch_release_date(c['slug'], c['info_url']), to_check)):
+                            c['release'] = release
+            for c in candidates:
+                if date and c['info_url']:
+                    match_date = release_date_matches(c.get('release'), date)
+                    if c.get('release'):
+                        print(f"[AW-DEBUG] {c['name']} release: {c['release']} vs {date} -> {match_date}", file=sys.stderr)
+                    if not match_date:
+                        continue
+                seen.add(c['slug'])
                 results.append({
-                    'id': slug,
-                    'slug': slug,
-                    'name': name.strip(),
+                    'id': c['slug'],
+                    'slug': c['slug'],
+                    'name': c['name'].strip(),
                     'episodes_count': 0
                 })
         except Exception as e:
@@ -159,7 +271,7 @@ def get_episodes(slug: str) -> List[Dict[str, Any]]:
     if not base_play.startswith('/'):
         base_play = '/' + base_play
     url = BASE_URL + base_play
-    r, ck = fetch(url)
+    r = fetch(url)
     if not r.ok:
         return []
     soup = BeautifulSoup(r.text, 'html.parser')
@@ -180,41 +292,85 @@ def get_episodes(slug: str) -> List[Dict[str, Any]]:
         })
     if not eps:
         eps.append({'id': url, 'number': 1, 'name': 'Movie'})
+    # Riscrittura dello store condiviso (lock esclusivo) solo se la mappa è cambiata o scaduta:
+    # get_episodes gira a ogni play, per ogni versione, in parallelo
+    episode_map = [[e['number'], e['id']] for e in eps]
+    if scraper_cache.get_cached(EPISODE_MAP_STORE, play_slug(slug)) != episode_map:
+        scraper_cache.put_cached(EPISODE_MAP_STORE, play_slug(slug), episode_map, ttl=EPISODE_MAP_TTL)
     return eps
 
-def get_mp4_from_page(url: str, cookies=None) -> Optional[str]:
-    r, ck = fetch(url, cookies=cookies)
+def _cached_episode_href(slug: str, episode: Optional[int]) -> Optional[str]:
+    """href dell'episodio dalla mappa in cache (primo episodio se `episode` è None)."""
+    episode_map = scraper_cache.get_cached(EPISODE_MAP_STORE, play_slug(slug))
+    if not episode_map:
+        return None
+    if episode is None:
+        return episode_map[0][1]
+    return next((href for number, href in episode_map if number == episode), None)
+
+def _head_alive(url: str) -> Optional[bool]:
+    """HEAD sul link: False se 404, True altrimenti, None su errore di rete (esito non salvato)."""
+    try:
+        h = SESSION.head(url, timeout=15)
+        return h.status_code != 404
+    except Exception:
+        return None
+
+def validate_link(url: str) -> bool:
+    """Validità del link download, in cache per URL (LINK_CHECK_TTL).
+    Un errore di rete non invalida il link (come prima), ma non viene messo in cache."""
+    cached = scraper_cache.get_cached(LINK_CHECK_STORE, url)
+    if cached is not None:
+        return cached
+    alive = _head_alive(url)
+    if alive is not None:
+        scraper_cache.put_cached(LINK_CHECK_STORE, url, alive, ttl=LINK_CHECK_TTL)
+    return alive is not False
+
+def _prescan_alt_link(text: str) -> Optional[str]:
+    """href di alternativeDownloadLink dal testo grezzo (per avviare la HEAD prima del parsing)."""
+    tag = ALT_LINK_TAG_RE.search(text)
+    href = HREF_RE.search(tag.group(0)) if tag else None
+    return html.unescape(href.group(1)) if href else None
+
+def get_mp4_from_page(url: str) -> Optional[str]:
+    r = fetch(url)
     if not r.ok:
         return None
+    # La verifica del link parte subito su un thread daemon, in parallelo al parsing della pagina
+    # (se il link letto dal parsing è diverso, la HEAD speculativa non ritarda l'uscita)
+    guess = _prescan_alt_link(r.text)
+    check = queue.Queue(maxsize=1)
+    if guess:
+        threading.Thread(target=lambda: check.put(validate_link(guess)), daemon=True).start()
     soup = BeautifulSoup(r.text, 'html.parser')
     a_tag = soup.find('a', id='alternativeDownloadLink')
     if a_tag and a_tag.get('href'):
         test = a_tag['href']
-        try:
-            h = requests.head(test, timeout=15, verify=False)
-            if h.status_code == 404:
-                return None
-        except Exception:
-            pass
-        return test
+        alive = check.get() if guess and test == guess else validate_link(test)
+        return test if alive else None
     return None
 
 def get_stream(slug: str, episode: int | None):
-    eps = get_episodes(slug)
-    if not eps:
-        return {'mp4_url': None, 'episode_page': None}
-    target = None
-    if episode is not None:
-        for e in eps:
-            if e['number'] == episode:
-                target = e
-                break
-        # Se episodio specifico non trovato, non fare fallback al primo
-        if target is None:
+    # Mappa numero -> href in cache: niente download della pagina /play/ anime.
+    # Un episodio assente (es. appena uscito) forza il refresh tramite get_episodes
+    href = _cached_episode_href(slug, episode)
+    if href is None:
+        eps = get_episodes(slug)
+        if not eps:
             return {'mp4_url': None, 'episode_page': None}
-    if not target:
-        target = eps[0]
-    href = target['id']
+        target = None
+        if episode is not None:
+            for e in eps:
+                if e['number'] == episode:
+                    target = e
+                    break
+            # Se episodio specifico non trovato, non fare fallback al primo
+            if target is None:
+                return {'mp4_url': None, 'episode_page': None}
+        if not target:
+            target = eps[0]
+        href = target['id']
     if href.startswith('/'):
         page_url = BASE_URL + href
     elif href.startswith('http'):
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache persistente condivisa dagli scraper anime (animesaturn, animeworld, animeunity).
+
+Ogni store è un file JSON in <root>/cache/<nome>.json. Gli script vengono lanciati
+dal lato Node come processi separati (anche in parallelo), quindi ogni accesso è
+protetto da un lock su file (<nome>.lock) e la scrittura avviene su file temporaneo
++ os.replace, come per la cache Vavoo.
+
+Formato record: {"value": ..., "ts": <epoch s>, "exp": <epoch s> | null}
+
+Variabili d'ambiente:
+  SCRAPER_CACHE_DIR=<path>   directory alternativa per la cache
+  SCRAPER_CACHE_DISABLE=1    disabilita lettura/scrittura (utile per debug)
+  SCRAPER_COOKIE_TTL=<sec>   durata di default dei cookie challenge (default 6h)
+"""
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import fcntl  # type: ignore
+    _HAVE_FCNTL = True
+except Exception:  # Windows: niente lock, la scrittura resta atomica via os.replace
+    fcntl = None  # type: ignore
+    _HAVE_FCNTL = False
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+CACHE_DIR = os.getenv("SCRAPER_CACHE_DIR") or os.path.join(PROJECT_ROOT, 'cache')
+CACHE_DISABLED = os.getenv("SCRAPER_CACHE_DISABLE", "0") == "1"
+COOKIE_TTL = int(os.getenv("SCRAPER_COOKIE_TTL", str(6 * 3600)))
+COOKIE_STORE = 'challenge_cookies'
+# I record scaduti da più di PRUNE_GRACE secondi vengono rimossi alla prima scrittura
+PRUNE_GRACE = 24 * 3600
+
+
+def _debug(msg: str):
+    if os.getenv("SCRAPER_CACHE_DEBUG", "0") == "1":
+        print(f"[CACHE] {msg}", file=sys.stderr)
+
+
+def _store_path(name: str) -> str:
+    return os.path.join(CACHE_DIR, f"{name}.json")
+
+
+@contextmanager
+def _locked(name: str, exclusive: bool):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fh = open(os.path.join(CACHE_DIR, f"{name}.lock"), 'a')
+    try:
+        if _HAVE_FCNTL:
+            fcntl.flock(fh, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+    finally:
+        if _HAVE_FCNTL:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+        fh.close()
+
+
+def _read(name: str) -> Dict[str, Any]:
+    path = _store_path(name)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    return data if isinstance(data, dict) else {}
+
+
+def load_store(name: str) -> Dict[str, Any]:
+    """Legge l'intero store; restituisce {} se mancante, corrotto o cache disabilitata."""
+    if CACHE_DISABLED or not os.path.exists(_store_path(name)):
+        return {}
+    try:
+        with _locked(name, exclusive=False):
+            return _read(name)
+    except Exception as e:
+        _debug(f"load_store {name} errore: {e}")
+        return {}
+
+
+def update_store(name: str, mutate: Callable[[Dict[str, Any]], None]) -> Dict[str, Any]:
+    """Read-modify-write sotto lock esclusivo. `mutate` modifica il dict in place."""
+    if CACHE_DISABLED:
+        return {}
+    try:
+        with _locked(name, exclusive=True):
+            try:
+                data = _read(name)
+            except Exception:
+                data = {}
+            mutate(data)
+            now = time.time()
+            for key in [k for k, rec in data.items()
+                        if isinstance(rec, dict) and rec.get('exp') and now - rec['exp'] > PRUNE_GRACE]:
+                del data[key]
+            path = _store_path(name)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp, path)
+            return data
+    except Exception as e:
+        _debug(f"update_store {name} errore: {e}")
+        return {}
+
+
+def get_record(name: str, key: str) -> Optional[Dict[str, Any]]:
+    """Record grezzo (anche se scaduto), per chi deve distinguere fresco/stale."""
+    rec = load_store(name).get(key)
+    return rec if isinstance(rec, dict) and 'value' in rec else None
+
+
+def is_fresh(rec: Optional[Dict[str, Any]], now: Optional[float] = None) -> bool:
+    if not rec:
+        return False
+    exp = rec.get('exp')
+    return exp is None or (now or time.time()) < exp
+
+
+def get_cached(name: str, key: str) -> Any:
+    """Valore se presente e non scaduto, altrimenti None."""
+    rec = get_record(name, key)
+    return rec['value'] if is_fresh(rec) else None
+
+
+def put_cached(name: str, key: str, value: Any, ttl: Optional[float] = None):
+    """Salva `value`; ttl=None significa record permanente."""
+    now = time.time()
+    rec = {"value": value, "ts": now, "exp": (now + ttl) if ttl is not None else None}
+
+    def _mutate(data):
+        data[key] = rec
+    update_store(name, _mutate)
+
+
+def drop_cached(name: str, key: str):
+    update_store(name, lambda data: data.pop(key, None))
+
+
+def sweep_stores(prefix: str, max_age: float, every: float = 24 * 3600):
+    """Elimina gli store `<prefix>*.json` (e relativi .lock) non scritti da più di `max_age` secondi.
+    Per gli store con un file per chiave, dove la potatura di update_store non basta: file di chiavi
+    mai più richieste resterebbero per sempre. Eseguito al massimo una volta ogni `every` secondi."""
+    if CACHE_DISABLED or not os.path.isdir(CACHE_DIR):
+        return
+    now = time.time()
+    marker = os.path.join(CACHE_DIR, f"{prefix}.sweep")
+    try:
+        if now - os.path.getmtime(marker) < every:
+            return
+    except OSError:
+        pass
+    try:
+        with open(marker, 'a'):
+            pass
+        os.utime(marker, None)
+        names = [f[:-len('.json')] for f in os.listdir(CACHE_DIR) if f.startswith(prefix) and f.endswith('.json')]
+    except OSError as e:
+        _debug(f"sweep_stores {prefix} errore: {e}")
+        return
+    removed = 0
+    for name in names:
+        path = _store_path(name)
+        try:
+            if now - os.path.getmtime(path) <= max_age:
+                continue
+            with _locked(name, exclusive=True):
+                # Ricontrollo sotto lock: un altro processo potrebbe averlo appena riscritto
+                if now - os.path.getmtime(path) <= max_age:
+                    continue
+                os.remove(path)
+            os.remove(os.path.join(CACHE_DIR, f"{name}.lock"))
+            removed += 1
+        except OSError:
+            pass
+    if removed:
+        _debug(f"sweep_stores {prefix}: rimossi {removed} store scaduti")
+
+
+@contextmanager
+def refresh_lock(name: str, key: str):
+    """Lock non bloccante per singola chiave (stale-while-revalidate fra processi).
+    Restituisce True se questo processo deve aggiornare il record, False se un altro
+    processo lo sta già facendo (il chiamante servirà il dato stale)."""
+    if CACHE_DISABLED or not _HAVE_FCNTL:
+        yield True
+        return
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        fh = open(os.path.join(CACHE_DIR, f"{name}.refresh.lock"), 'a')
+    except Exception as e:
+        _debug(f"refresh_lock {name} errore: {e}")
+        yield True
+        return
+    # Un byte per chiave dello stesso file: niente file di lock per ogni chiave
+    offset = int(hashlib.sha1(key.encode('utf-8')).hexdigest()[:8], 16)
+    try:
+        try:
+            fcntl.lockf(fh, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, offset)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.lockf(fh, fcntl.LOCK_UN, 1, offset)
+    finally:
+        fh.close()
+
+
+# ---------------------- COOKIE VAULT (challenge ASFast / SecurityAW) ----------------------
+
+def cookie_ttl(cookie_str: str) -> int:
+    """Durata di un cookie impostato via document.cookie (max-age / expires), default COOKIE_TTL."""
+    m = re.search(r'max-age\s*=\s*(\d+)', cookie_str, re.I)
+    if m:
+        return int(m.group(1))
+    m = re.search(r'expires\s*=\s*([^;"]+)', cookie_str, re.I)
+    if m:
+        try:
+            from email.utils import parsedate_to_datetime
+            remaining = parsedate_to_datetime(m.group(1).strip()).timestamp() - time.time()
+            if remaining > 0:
+                return int(remaining)
+        except Exception:
+            pass
+    return COOKIE_TTL
+
+
+def load_cookies(host: str, session=None) -> Dict[str, str]:
+    """Cookie challenge validi per `host`. Se `session` è passata li imposta su host e www.host."""
+    now = time.time()
+    cookies: Dict[str, str] = {}
+    prefix = f"{host}|"
+    for key, rec in load_store(COOKIE_STORE).items():
+        if key.startswith(prefix) and isinstance(rec, dict) and is_fresh(rec, now):
+            cookies[key[len(prefix):]] = rec['value']
+    if session is not None:
+        for name, value in cookies.items():
+            session.cookies.set(name, value, domain=host)
+            if not host.startswith('www.'):
+                session.cookies.set(name, value, domain='www.' + host)
+    if cookies:
+        _debug(f"load_cookies {host}: {list(cookies)}")
+    return cookies
+
+
+def save_cookie(host: str, name: str, value: str, ttl: Optional[int] = None):
+    """Registra un cookie challenge ottenuto per `host` (sostituisce eventuali versioni precedenti)."""
+    now = time.time()
+    ttl = COOKIE_TTL if ttl is None else ttl
+
+    def _mutate(data):
+        # Il nome del cookie challenge cambia nel tempo (suffisso casuale): ne teniamo uno per prefisso
+        family = name.split('-')[0]
+        for key in [k for k in data if k.startswith(f"{host}|{family}-")]:
+            del data[key]
+        data[f"{host}|{name}"] = {"value": value, "ts": now, "exp": now + ttl}
+    update_store(COOKIE_STORE, _mutate)